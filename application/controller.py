@@ -1,27 +1,53 @@
 import asyncio
-import tkinter as tk
-from typing import Union
-from bleak import discover, BleakClient
+import logging
+import time
+from typing import TYPE_CHECKING, List, Union
+from bleak import BleakClient
 from bleak.exc import BleakError
 from datetime import datetime, timedelta
-from plyer import notification
 from functools import wraps
 from warnings import warn
-from utils import *
+from utils import (BatteryState, Color, NotificationValue, Request, State, TemperatureConversion, TemperatureScale,
+                   decode_temperature, encode_temperature, parse_battery, parse_color)
 import sys
 sys.path.append('..')
 from codes import codes
-from logger import logger
-from time import sleep
+import frames
+from gatt import CharacteristicIndex
+from handshake import Handshake
+from pipeline import CommandQueue, DEFAULT_WINDOW
+from profile_cache import DeviceProfile, ProfileCache
+from supervisor import Supervisor, in_steps, probe
+from coalesce import Coalescer, MIN_INTERVAL
+from poller import AdaptivePoller
+from reads import ReadCache
+from observable import Field, Observable
+from metrics import metrics
+from logger import Hex, logger, trace_logger
+
+if TYPE_CHECKING:
+    import tkinter as tk
+    from effects import Effect, Player
+
+tx = trace_logger("tx")
 
 def ble_error_catch(func):
+    # fetches are timed per light, every caught failure is counted
+    timed = func.__name__.startswith('fetch_')
+    operation = 'controller_' + func.__name__
+
     if asyncio.iscoroutinefunction(func):
         @wraps(func)
         async def async_inner(self, *args, **kwargs):
+            started = time.perf_counter()
             try:
                 return await func(self, *args, **kwargs)
             except (RuntimeError, BleakError):
+                metrics.inc('ble_errors', self.client.address)
                 warn(f"'{func.__name__}' was failed because of Bluetooth error.")
+            finally:
+                if timed:
+                    metrics.observe(operation, time.perf_counter() - started, self.client.address)
         return async_inner
 
     else:
@@ -30,15 +56,27 @@ def ble_error_catch(func):
             try:
                 return func(self, *args, **kwargs)
             except (RuntimeError, BleakError):
+                metrics.inc('ble_errors', self.client.address)
                 warn(f"'{func.__name__}' was failed because of Bluetooth error.")
         return inner
 
 
-class Controller:
+class Controller(Observable):
     notify_interval = 180  # won't notify until after 180 seconds from last notification
 
-    def __init__(self, client: BleakClient, notify_when_complete=False):
+    # assigning a different value to any of these marks it dirty for the GUI
+    battery = Field()
+    temperature = Field()
+    setting_temperature = Field()
+    state = Field()
+    color = Field()
+    temperature_scale = Field()
+
+    def __init__(self, client: BleakClient, notify_when_complete=False, window=DEFAULT_WINDOW,
+                 profiles: Union[ProfileCache, None] = None, min_interval=MIN_INTERVAL):
+        super().__init__()
         self.client = client
+        self.profiles = profiles or ProfileCache()
 
         self.battery: Union[BatteryState, None] = None
         self.temperature: Union[float, None] = None
@@ -52,20 +90,34 @@ class Controller:
 
         self.running = False
 
-        self.gui: Union[tk.Frame, None] = None
+        self.gui: Union['tk.Frame', None] = None
+
+        self.index: Union[CharacteristicIndex, None] = None
+        self.queue = CommandQueue(self._write, window)
+        self.supervisor = Supervisor('LED', self.reconnect, lambda: probe(self.client, self.index), self.replay)
+        self.coalescer = Coalescer(self._send, min_interval)
+        self.poller = AdaptivePoller()
+        self.reads = ReadCache(self.client.read_gatt_char)
+        self.player: Union['Player', None] = None
+        self._effect: Union[asyncio.Task, None] = None
+
+    @property
+    def poll_rate(self) -> float:
+        # polls per second the state fallback is currently running at
+        return self.poller.rate
 
     async def start(self):
         self.running = True
 
         # write value to turn off Ember's bluetooth led
         await self.client.write_gatt_char(Request.TemperatureScale.as_uuid,
-                                          await self.client.read_gatt_char(Request.TemperatureScale.as_uuid))
+                                          await self.reads.read(Request.TemperatureScale.as_uuid))
 
         await self.client.start_notify(Request.Notification.as_uuid, self.notify_callback())
 
         await asyncio.gather(self.set_schedule(), self.initial_fetch_values())
 
-    async def start_with_gui(self, frame: tk.Frame):
+    async def start_with_gui(self, frame: 'tk.Frame'):
         self.running = True
 
         self.gui = frame
@@ -74,63 +126,44 @@ class Controller:
         # await self.client.write_gatt_char(Request.TemperatureScale.as_uuid,
         #                                   await self.client.read_gatt_char(Request.TemperatureScale.as_uuid))
 
-        # Enable notifications on all notifiable characteristics
-        logger.info("Enabling notifications, reading and writing...")
-        for service in self.client.services:
-            for char in service.characteristics:
-                # logger.info(" ".join(char.properties))
-                if "notify" in char.properties and char.uuid[0] != "0":
-                    logger.info(f"Enabling notification on char {char.uuid}")
-                    await self.client.start_notify(char, self.notify_callback()) # notification_handler)  # type: ignore
-                    # break
-                sleep(0.1)
-                if "write" in char.properties:
-                    logger.info(f"Writing to char {char.uuid}")
-                    await self.client.write_gatt_char(
-                        # "B02EAEAA-F6BC-4A7E-BC94-F7B7FC8DEDOB",
-                        char,
-                        bytearray([0xFE, 0x01, 0x00, 0x02, 0x50, 0x11]), response=True)
-                    sleep(0.1)
-                    await self.client.write_gatt_char(
-                        # "B02EAEAA-F6BC-4A7E-BC94-F7B7FC8DEDOB",
-                        char,
-                        bytearray([0xFE, 0x01, 0x00, 0x02, 0x30, 0x04]), response=True)
-
-                    today = datetime.now()
-                    datetime_now_str = today.strftime("%Y%m%d%H%M%S")
-                    # logger.info(f"today's datetime: {datetime_now_str}")
-                    datetime_now_bytes = datetime_now_str.encode()
-                    payload = bytearray([0xFE, 0x01, 0x00, 0x10, 0x50, 0x01])
-                    payload.extend(datetime_now_bytes)
-                    await self.client.write_gatt_char(
-                        # "B02EAEAA-F6BC-4A7E-BC94-F7B7FC8DEDOB",
-                        char, payload, response=True)
-
-                if "read" in char.properties:
-                    logger.info(f"Reading from {char.uuid}")
-                    await self.client.read_gatt_char(char)
-            logger.info("Done enabling notifications")
-        logger.info("Done enabling notifications")
-
-        # setup reading - is this necessary???
-        for service in self.client.services:
-            for char in service.characteristics:
-                if "read" in char.properties:
-                    logger.info(f"Reading from {char.uuid}")
-                    await self.client.read_gatt_char(char)
+        await self._handshake()
+        self.supervisor.start()
 
         # write to led
-        for service in self.client.services:
-            for char in service.characteristics:
-                if "write" in char.properties:
-                    logger.info(f"Writing to char {char.uuid} SET COLOR")
-                    # event.clear()
-                    data = codes["colors"]["GREEN"]
-                    await self.client.write_gatt_char(char, data, response=True)
+        logger.info(f"Writing to char {self.index.control.uuid} SET COLOR")
+        await self._send(codes["colors"]["GREEN"])
 
 
         await asyncio.gather(self.set_schedule(), self.initial_fetch_values(True))
 
+    async def _handshake(self):
+        self.index = CharacteristicIndex(self.client.services)
+        logger.info(f"Resolved characteristics: {self.index}")
+
+        # A profile that still matches the device means the initial reads were done on an earlier run
+        profile = self.profiles.validate(self.client.address, self.client.services)
+        await Handshake(self.client, self.index, self.notify_callback(), profile, pair=False).run()
+        if profile is None:
+            self.profiles.save(DeviceProfile.from_index(self.client.address, self.index, pairing="skipped"))
+
+    async def reconnect(self):
+        await self.client.connect()
+        self.reads.invalidate()
+        await self._handshake()
+
+    def disconnected(self, _client: Union[BleakClient, None] = None):
+        self.supervisor.disconnected()
+
+    async def replay(self, batch: List[bytes]):
+        # power on is written before the rest and power off after them, not raced against them in the window
+        for step in in_steps(batch):
+            await asyncio.gather(*(self.queue.put(frame) for frame in step))
+
+    async def _send(self, data: bytes):
+        # while the light is away only the desired state is updated, it is replayed on reconnect
+        if self.supervisor.record(data):
+            await self.queue.send(data)
+
     def notify(self):
         last = self.last_notify
         self.last_notify = datetime.now()
@@ -141,33 +174,36 @@ class Controller:
             temp = '{}°C'.format(self.setting_temperature)
         else:
             temp = '{}°F'.format(int(TemperatureConversion.c2f(self.setting_temperature)))
+        # desktop notifications are the only use of plyer, so it is loaded only when one is shown
+        from plyer import notification
         notification.notify(title='Your Drink is Waiting For You!',
                             message='Your drink is waiting for you to drink!. It\'s nice and warm {}!'.format(temp),
                             app_name='LED Controller')
 
     @ble_error_catch
     async def fetch_battery_state(self):
-        value = await self.client.read_gatt_char(Request.Battery.as_uuid)
+        value = await self.reads.read(Request.Battery.as_uuid)
         self.battery = parse_battery(value)
 
     @ble_error_catch
     async def fetch_temperature(self):
-        value = await self.client.read_gatt_char(Request.Temperature.as_uuid)
+        value = await self.reads.read(Request.Temperature.as_uuid)
         self.temperature = decode_temperature(value)
 
     @ble_error_catch
     async def fetch_setting_temperature(self):
-        value = await self.client.read_gatt_char(Request.SettingTemperature.as_uuid)
+        value = await self.reads.read(Request.SettingTemperature.as_uuid)
         self.setting_temperature = decode_temperature(value)
 
     @ble_error_catch
     async def set_setting_temperature(self, value: float):
         await self.client.write_gatt_char(Request.SettingTemperature.as_uuid, encode_temperature(value))
+        self.reads.invalidate(Request.SettingTemperature.as_uuid)
         self.setting_temperature = value
 
     @ble_error_catch
     async def fetch_state(self):
-        value = await self.client.read_gatt_char(Request.State.as_uuid)
+        value = await self.reads.read(Request.State.as_uuid)
         state = State(value[0])
         if state == State.Poured:
             await self.set_setting_temperature(max(self.setting_temperature, 50.0))
@@ -177,73 +213,101 @@ class Controller:
 
     @ble_error_catch
     async def fetch_color(self):
-        value = await self.client.read_gatt_char(Request.LightColor.as_uuid)
+        value = await self.reads.read(Request.LightColor.as_uuid)
         self.color = parse_color(value)
 
     @ble_error_catch
     async def set_color(self, color: Color):
-
-        color_as_bytearray = color.as_bytearray
-        # logger.info(color_as_bytearray)
-        # logger.info(codes["colors"]["LBLUE"])
-
-        # write to led
-        for service in self.client.services:
-            for char in service.characteristics:
-                if "write" in char.properties:
-                    logger.info(f"Writing to char {char.uuid} SET COLOR")
-                    # event.clear()
-                    data = codes["colors"]["LBLUE"]
-                    await self.client.write_gatt_char(char, color_as_bytearray, response=True)
+        logger.info("SET COLOR %s", color.as_rgb)
+        await self._send(color.as_frame)
 
         # await self.client.write_gatt_char(Request.LightColor.as_uuid, color.as_bytearray)
         self.color = color
 
     @ble_error_catch
     async def set_brightness(self, brightness_value: int):
-        for service in self.client.services:
-            for char in service.characteristics:
-                if "write" in char.properties:
-                    logger.info(f"Writing to char {char.uuid} SET COLOR")
-                    # event.clear()
-                    brightness_bytes = bytearray([
-                        0xFE, 0x01, 0x00, 0x03, 0x10, 0x02,
-                        brightness_value])
-                    logger.info(brightness_bytes)
-                    await self.client.write_gatt_char(char, brightness_bytes, response=True)
+        logger.info("SET BRIGHTNESS %d", brightness_value)
+        await self._send(frames.encode_brightness(brightness_value))
+
+    # Non-blocking setters for UI callbacks: only the latest value of each kind is kept and sent
+    def request_color(self, color: Color):
+        self.color = color
+        self.coalescer.submit(color.as_frame)
+
+    def request_brightness(self, brightness_value: int):
+        self.coalescer.submit(frames.encode_brightness(brightness_value))
+
+    def request_power(self, on: bool):
+        self.coalescer.submit(frames.encode_power(on))
+
+    def play_effect(self, effect: 'Effect', duration: Union[float, None] = None) -> asyncio.Task:
+        # effects need NumPy, so they are loaded only when one is played
+        from effects import Player
+        self.stop_effect()
+        if self.player is None:
+            # one player for the controller's lifetime keeps its write latency estimate between effects
+            self.player = Player(self._send)
+        self._effect = asyncio.create_task(self.player.play(effect, duration))
+        return self._effect
+
+    def stop_effect(self):
+        if self._effect is not None:
+            self._effect.cancel()
+            self._effect = None
+
+    async def _write(self, data: bytes, response: bool):
+        # write to led
+        if self.index is None:
+            self.index = CharacteristicIndex(self.client.services)
+        if tx.isEnabledFor(logging.DEBUG):
+            tx.debug("Writing to %s (response=%s): %s", self.client.address, response, Hex(data))
+        with metrics.timer('ble_write', self.client.address):
+            await self.client.write_gatt_char(self.index.control, data, response=response)
 
 
     @ble_error_catch
     async def fetch_temperature_scale(self):
-        value = await self.client.read_gatt_char(Request.TemperatureScale.as_uuid)
+        value = await self.reads.read(Request.TemperatureScale.as_uuid)
         self.temperature_scale = TemperatureScale(value[0])
 
     @ble_error_catch
     async def set_temperature_scale(self, scale: TemperatureScale):
         await self.client.write_gatt_char(Request.TemperatureScale.as_uuid, scale.as_bytearray)
+        self.reads.invalidate(Request.TemperatureScale.as_uuid)
         self.temperature_scale = scale
 
     @ble_error_catch
     async def set_schedule(self):
-        while True:
+        # Notifications drive the updates, this only catches what they miss and backs off while nothing changes
+        while self.running:
+            await self.poller.wait()
             if not self.running:
                 break
-            await self.fetch_state()
-            await self.fetch_setting_temperature()
-            await asyncio.sleep(1)
+            if not self.supervisor.online.is_set():
+                continue
+            before = (self.state, self.setting_temperature)
+            await self.fetch_values(Controller.fetch_state, Controller.fetch_setting_temperature)
+            if (self.state, self.setting_temperature) != before:
+                self.poller.activity()
+            else:
+                self.poller.idle()
+
+    async def fetch_values(self, *fetchers):
+        # the reads go out together, and anything fetched moments ago comes from the cache
+        await asyncio.gather(*(fetch(self) for fetch in fetchers))
 
     async def initial_fetch_values(self, run_updater=False):
-        # await self.fetch_state()
-        await self.fetch_color()
-        # await self.fetch_temperature_scale()
-        # await self.fetch_setting_temperature()
-        # await self.fetch_temperature()
-        # await self.fetch_battery_state()
+        await self.fetch_values(Controller.fetch_color)
+        # await self.fetch_values(Controller.fetch_state, Controller.fetch_temperature_scale,
+        #                         Controller.fetch_setting_temperature, Controller.fetch_temperature,
+        #                         Controller.fetch_battery_state)
 
         async def updater():
             while self.running and self.gui.alive:
-                self.gui.update_()
-                self.gui.update()
+                # only widgets showing a changed field are touched, a static light costs no redraws
+                if self.dirty:
+                    self.gui.update_(self.take_dirty())
+                self.gui.pump()
                 await asyncio.sleep(1 / 15)
             await self.quit()
 
@@ -253,6 +317,11 @@ class Controller:
     async def quit(self):
         print('quitting...')
         self.running = False
+        self.poller.wake()
+        self.stop_effect()
+        await self.coalescer.close()
+        await self.supervisor.stop()
+        await self.queue.close()
         await self.client.disconnect()
 
     def notify_callback(self):
@@ -260,15 +329,27 @@ class Controller:
         async def callback(_: int, data: bytearray) -> None:
             if not self.running:
                 return await self.client.stop_notify(Request.Notification.as_uuid)
-            notification = NotificationValue(data[0])
+            try:
+                notification = NotificationValue(data[0])
+            except ValueError:
+                return
+            # something is happening, so poll at the fastest rate again for a while
+            self.poller.activity()
 
+            # the notification says these changed, so cached copies are stale
             if (notification is NotificationValue.BatteryChargeChange or
                     notification is NotificationValue.OnCoaster or
                     notification is NotificationValue.OffCoaster):
+                self.reads.invalidate(Request.Battery.as_uuid)
                 await self.fetch_battery_state()
 
             elif (notification is NotificationValue.TemperatureChange or
                   notification is NotificationValue.HeatingStateChange):
-                await self.fetch_temperature()
+                self.reads.invalidate(Request.Temperature.as_uuid, Request.State.as_uuid)
+                await self.fetch_values(Controller.fetch_temperature, Controller.fetch_state)
+
+            elif notification is NotificationValue.Poured:
+                self.reads.invalidate(Request.State.as_uuid, Request.SettingTemperature.as_uuid)
+                await self.fetch_values(Controller.fetch_state, Controller.fetch_setting_temperature)
 
         return callback
\ No newline at end of file
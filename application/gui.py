@@ -1,9 +1,7 @@
-import asyncio
+import _tkinter
 import tkinter as tk
 from utils import Color, State, BatteryState, TemperatureScale, TemperatureConversion
 
-from tkcolorpicker import askcolor
-
 import sys
 sys.path.append('..')
 from logger import logger
@@ -14,6 +12,9 @@ GRAY = '#555555'
 
 
 class Application(tk.Frame):
+    # controller fields in the order they are redrawn, the scale before the temperatures it formats
+    RENDER_ORDER = ('battery', 'temperature_scale', 'temperature', 'setting_temperature', 'color', 'state')
+
     def __init__(self, controller: 'Controller', master=None):
         super().__init__(master)
 
@@ -61,6 +62,8 @@ class Application(tk.Frame):
                                           orient=tk.HORIZONTAL,
                                            # from=0, to=100
                                           variable=self.brightness_value,
+                                          # follow the slider while dragging, the controller coalesces
+                                          command=lambda _: self.set_brightness(),
                                           )
         self.brightness_slider.place(x=2, y=30)
 
@@ -73,66 +76,93 @@ class Application(tk.Frame):
         self.brightness_button.place(x=110, y=50)
 
 
-    def update_(self):
-        if self.controller.battery is not None:
-            self.battery.set('{}%'.format(self.controller.battery.battery_charge))
-            if self.prev_battery.is_charging != self.controller.battery.is_charging:
-                if self.controller.battery.is_charging:
-                    self.canvas.itemconfig(self.battery_canvas, image=self.charging)
-                elif self.controller.battery.battery_charge > 20:
-                    self.canvas.itemconfig(self.battery_canvas, image=self.normal)
-                else:
-                    self.canvas.itemconfig(self.battery_canvas, image=self.low)
-            elif not self.controller.battery.is_charging:
-                if self.prev_battery.battery_charge <= 20 and self.controller.battery.battery_charge > 20:
-                    self.canvas.itemconfig(self.battery_canvas, image=self.normal)
-                elif self.prev_battery.battery_charge > 20 and self.controller.battery.battery_charge <= 20:
-                    self.canvas.itemconfig(self.battery_canvas, image=self.low)
-            self.prev_battery = self.controller.battery
-        if self.controller.temperature is not None:
-            if self.temperature_scale is TemperatureScale.Celsius:
-                self.temperature.set('{}°'.format(self.controller.temperature))
-            else:
-                self.temperature.set('{}°'.format(int(TemperatureConversion.c2f(self.controller.temperature))))
-        if self.controller.setting_temperature is not None:
-            if self.temperature_scale is TemperatureScale.Celsius:
-                self.setting_temperature.set('{}°'.format(self.controller.setting_temperature))
+    def update_(self, dirty):
+        # redraw only what changed; the scale also changes how both temperatures read
+        if 'temperature_scale' in dirty:
+            dirty = dirty | {'temperature', 'setting_temperature'}
+        for name in self.RENDER_ORDER:
+            if name in dirty:
+                getattr(self, '_render_' + name)()
+
+    def pump(self):
+        # handle whatever Tk has pending without waiting, so an idle window costs next to nothing
+        while self.master.tk.dooneevent(_tkinter.DONT_WAIT):
+            pass
+
+    def _render_battery(self):
+        if self.controller.battery is None:
+            return
+        self.battery.set('{}%'.format(self.controller.battery.battery_charge))
+        if self.prev_battery.is_charging != self.controller.battery.is_charging:
+            if self.controller.battery.is_charging:
+                self.canvas.itemconfig(self.battery_canvas, image=self.charging)
+            elif self.controller.battery.battery_charge > 20:
+                self.canvas.itemconfig(self.battery_canvas, image=self.normal)
             else:
-                self.setting_temperature.set('{}°'.format(int(TemperatureConversion.c2f(self.controller.setting_temperature))))
+                self.canvas.itemconfig(self.battery_canvas, image=self.low)
+        elif not self.controller.battery.is_charging:
+            if self.prev_battery.battery_charge <= 20 and self.controller.battery.battery_charge > 20:
+                self.canvas.itemconfig(self.battery_canvas, image=self.normal)
+            elif self.prev_battery.battery_charge > 20 and self.controller.battery.battery_charge <= 20:
+                self.canvas.itemconfig(self.battery_canvas, image=self.low)
+        self.prev_battery = self.controller.battery
+
+    def _render_temperature(self):
+        if self.controller.temperature is None:
+            return
+        if self.temperature_scale is TemperatureScale.Celsius:
+            self.temperature.set('{}°'.format(self.controller.temperature))
+        else:
+            self.temperature.set('{}°'.format(int(TemperatureConversion.c2f(self.controller.temperature))))
+
+    def _render_setting_temperature(self):
+        if self.controller.setting_temperature is None:
+            return
+        if self.temperature_scale is TemperatureScale.Celsius:
+            self.setting_temperature.set('{}°'.format(self.controller.setting_temperature))
+        else:
+            self.setting_temperature.set('{}°'.format(int(TemperatureConversion.c2f(self.controller.setting_temperature))))
+
+    def _render_temperature_scale(self):
         if self.controller.temperature_scale != self.temperature_scale:
             if self.controller.temperature_scale == TemperatureScale.Celsius:
                 self.temperature_scale_button.config(text=" °C ")
             else:
                 self.temperature_scale_button.config(text=" °F ")
             self.temperature_scale = self.controller.temperature_scale
+
+    def _render_color(self):
         if self.controller.color is not None:
             self.color_button.configure(bg=self.controller.color.as_rgb)
-        if self.controller.state is not None:
-            self.state.set(self.controller.state.name)
 
-            if self.controller.state in (State.Empty, State.FinishDrinking) and \
-                    self.prev_state in (State.Poured, State.Cooling, State.Heating, State.Keeping):
-                self.canvas.itemconfig(self.mug_canvas, image=self.empty)
-                self.prev_state = self.controller.state
+    def _render_state(self):
+        if self.controller.state is None:
+            return
+        self.state.set(self.controller.state.name)
+
+        if self.controller.state in (State.Empty, State.FinishDrinking) and \
+                self.prev_state in (State.Poured, State.Cooling, State.Heating, State.Keeping):
+            self.canvas.itemconfig(self.mug_canvas, image=self.empty)
+            self.prev_state = self.controller.state
 
-            elif self.prev_state in (State.Empty, State.FinishDrinking, State.Cooling, State.Keeping) and \
-                    self.controller.state in (State.Poured, State.Heating, State.Off):
-                self.canvas.itemconfig(self.mug_canvas, image=self.heating)
-                self.prev_state = self.controller.state
+        elif self.prev_state in (State.Empty, State.FinishDrinking, State.Cooling, State.Keeping) and \
+                self.controller.state in (State.Poured, State.Heating, State.Off):
+            self.canvas.itemconfig(self.mug_canvas, image=self.heating)
+            self.prev_state = self.controller.state
 
-            elif self.prev_state in (State.Empty, State.FinishDrinking, State.Off, State.Heating) and \
-                    self.controller.state in (State.Cooling, State.Keeping):
-                self.canvas.itemconfig(self.mug_canvas, image=self.complete)
-                self.prev_state = self.controller.state
+        elif self.prev_state in (State.Empty, State.FinishDrinking, State.Off, State.Heating) and \
+                self.controller.state in (State.Cooling, State.Keeping):
+            self.canvas.itemconfig(self.mug_canvas, image=self.complete)
+            self.prev_state = self.controller.state
 
     def pick_color(self):
+        from tkcolorpicker import askcolor
         color = askcolor((255, 255, 0), self, alpha=True)
         if not color:
             return
-        asyncio.gather(self.controller.set_color(Color(*color[0])))
+        self.controller.request_color(Color(*color[0]))
 
     def set_brightness(self):
-        brightness = self.brightness_value.get()
-        brightness = int(brightness)
-        logger.info(f"brightness_value: {brightness}")
-        asyncio.gather(self.controller.set_brightness(brightness))
+        brightness = int(self.brightness_value.get())
+        logger.debug(f"brightness_value: {brightness}")
+        self.controller.request_brightness(brightness)
@@ -5,32 +5,32 @@ sys.path.append('..')
 from utils import *
 import tkinter as tk
 import asyncio
-from bleak import discover, BleakClient
+import time
+from bleak import BleakClient
 from logger import logger
+from scanner import Scanner
 from controller import Controller
 from gui import Application
 
 
 async def main():
-    devices = await discover()
     print("searching for devices...")
-    for d in devices:
-        # logger.info(f"\tDiscovered: {d}")
-        print(d.address)
-        if d.address == LED_BLUETOOTH_ADDRESS:
-            print("device found, connecting...")
-            ember = d
-            break
-    else:
+    scanner = Scanner()
+    ember = (await scanner.find([LED_BLUETOOTH_ADDRESS])).get(LED_BLUETOOTH_ADDRESS.upper())
+    if ember is None:
         print('LED is not found. Exiting...')
         return
+    print("device found in {:.3f}s, connecting...".format(scanner.time_to_discover))
 
-    async with BleakClient(ember.address) as client:
+    # Pass the discovered device rather than its address, otherwise bleak scans for it again
+    started = time.monotonic()
+    async with BleakClient(ember) as client:
         x = client.is_connected
-        print("Connected: {0}".format(x))
+        print("Connected: {0} in {1:.3f}s".format(x, time.monotonic() - started))
         try:
             # await client.pair()
             cont = Controller(client, True)
+            client.set_disconnected_callback(cont.disconnected)
             root = tk.Tk()
             root.protocol("WM_DELETE_WINDOW", lambda: asyncio.gather(cont.quit()))
             root.title('LED Controller')
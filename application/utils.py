@@ -1,4 +1,7 @@
 from enum import IntEnum, Enum
+import sys
+sys.path.append('..')
+import frames
 
 CharacteristicBase = 'FC5400{:02x}-236C-4C94-8FA9-944A3E5353FA'
 EMBER_MANUFACTURER_CODE = 0xFFFF
@@ -100,12 +103,13 @@ class Color:
 
     @property
     def as_bytearray(self) -> bytearray:
-        print([self.r, self.g, self.b])
-        print(bytearray([self.r, self.g, self.b]))
         # return bytearray([self.r, self.g, self.b, self.a])
-        return bytearray([0xFE, 0x01, 0x00, 0x06, 0x20, 0x01,
-                          self.r, self.g, self.b, 0x00
-                          ])
+        return bytearray(frames.encode_color(self.r, self.g, self.b))
+
+    @property
+    def as_frame(self) -> memoryview:
+        # zero-copy view into the shared color encoder, only valid until the next color is encoded
+        return frames.encode_color(self.r, self.g, self.b)
 
     @property
     def as_rgb(self) -> str:
@@ -115,6 +119,14 @@ class Color:
     def as_rgba(self) -> str:
         return '#{:02x}{:02x}{:02x}{:02x}'.format(self.r, self.g, self.b, self.a)
 
+    def __eq__(self, other):
+        if not isinstance(other, Color):
+            return NotImplemented
+        return (self.r, self.g, self.b, self.a) == (other.r, other.g, other.b, other.a)
+
+    def __hash__(self):
+        return hash((self.r, self.g, self.b, self.a))
+
     def __repr__(self):
         return 'Color(r={!r}, g={!r}, b={!r}, a={!r})'.format(self.r, self.g, self.b, self.a)
 
@@ -136,6 +148,14 @@ class BatteryState:
         self.battery_charge = battery_charge
         self.is_charging = is_charging
 
+    def __eq__(self, other):
+        if not isinstance(other, BatteryState):
+            return NotImplemented
+        return (self.battery_charge, self.is_charging) == (other.battery_charge, other.is_charging)
+
+    def __hash__(self):
+        return hash((self.battery_charge, self.is_charging))
+
     def __repr__(self):
         return 'BatteryState(battery_charge={!r}, is_charging={!r})'.format(self.battery_charge, self.is_charging)
 
@@ -0,0 +1,54 @@
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import frames
+from codes import codes
+
+NUMBER = 200_000
+
+
+def legacy_color(r: int, g: int, b: int) -> bytearray:
+    frame = codes["colors"]["BASE"].copy()
+    frame.extend([r, g, b, 0x00])
+    return frame
+
+
+def legacy_brightness(percent: int) -> bytearray:
+    frame = codes["brightness"]["custom"].copy()
+    frame.extend([percent])
+    return frame
+
+
+def allocations(func, *args) -> float:
+    # bytes allocated per frame when every returned frame is kept (e.g. while queued for a write)
+    kept = [None] * 1000
+    tracemalloc.start()
+    for i in range(len(kept)):
+        kept[i] = func(*args)
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return allocated / len(kept)
+
+
+def bench(name: str, func, *args) -> None:
+    seconds = min(timeit.repeat(lambda: func(*args), number=NUMBER, repeat=5))
+    print(f"{name:<24} {seconds / NUMBER * 1e9:8.1f} ns/frame  {allocations(func, *args):6.1f} B/frame")
+
+
+def main() -> None:
+    assert bytes(frames.encode_color(1, 2, 3)) == bytes(legacy_color(1, 2, 3))
+    assert bytes(frames.encode_brightness(0x40)) == bytes(legacy_brightness(0x40))
+
+    bench("legacy color", legacy_color, 0x12, 0x34, 0x56)
+    bench("frames.encode_color", frames.encode_color, 0x12, 0x34, 0x56)
+    bench("legacy brightness", legacy_brightness, 0x40)
+    bench("frames.encode_brightness", frames.encode_brightness, 0x40)
+    bench("frames.encode_power", frames.encode_power, True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import os
+import random
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import frames
+from classes import Response
+from packetizer import PACKET_OVERHEAD, Packetizer, bytes_on_air, fragment
+
+MTUS = [23, 185, 247]
+SIZES = [6, 20, 31, 32, 100, 1024, 8191, 8192, 65535]
+NUMBER = 20_000
+
+
+def round_trip(message: bytes, size: int) -> None:
+    # Whatever the length, the packets must reassemble into the message exactly
+    response = Response()
+    for packet in fragment(message, size):
+        assert len(packet) <= size, (len(packet), size)
+        response.accumulate(packet)
+    assert response.is_received and bytes(response.bytes) == message, (len(message), size)
+
+
+def verify() -> None:
+    rng = random.Random(1)
+    for mtu in MTUS:
+        packetizer = Packetizer(mtu)
+        for size in SIZES:
+            round_trip(rng.randbytes(size), packetizer.payload_size)
+        # Packed frames are the same bytes, just fewer writes
+        commands = scene() + [bytes(frames.encode_datetime())]
+        writes = packetizer.pack(commands)
+        assert all(len(write) <= packetizer.payload_size for write in writes)
+        assert b"".join(write for write in writes if write[0] == 0xFE) == b"".join(
+            command for command in commands if len(command) <= packetizer.payload_size)
+
+
+def scene() -> list:
+    return [bytes(frames.encode_power(True)), bytes(frames.encode_color(0xFF, 0xB4, 0x50)),
+            bytes(frames.encode_brightness(60)), bytes(frames.encode_timer(30))]
+
+
+def main() -> None:
+    verify()
+    print(f"{PACKET_OVERHEAD} bytes of framing per packet on air\n")
+
+    print(f"{'message':>8} " + " ".join(f"{'MTU ' + str(mtu):>22}" for mtu in MTUS))
+    for size in SIZES:
+        cells = []
+        for mtu in MTUS:
+            packetizer = Packetizer(mtu)
+            packets = packetizer.packets(bytes(size))
+            cells.append(f"{len(packets):6d} pkt {bytes_on_air(packets):7d} B")
+        print(f"{size:>8} " + " ".join(f"{cell:>22}" for cell in cells))
+
+    print()
+    commands = scene()
+    for mtu in MTUS:
+        packetizer = Packetizer(mtu)
+        one_each = bytes_on_air(commands)
+        packed = packetizer.pack(commands)
+        print(f"scene of {len(commands)} commands, MTU {mtu:3d}: {one_each / len(commands):5.1f} B/command one per write, "
+              f"{bytes_on_air(packed) / len(commands):5.1f} B/command packed into {len(packed)} writes")
+
+    print()
+    datetime = bytes(frames.encode_datetime())
+    large = bytes(4096)
+    for name, func in [
+        ("packets(command)", lambda: Packetizer(23).packets(commands[1])),
+        ("packets(datetime)", lambda: Packetizer(23).packets(datetime)),
+        ("packets(4096 B, MTU 23)", lambda: Packetizer(23).packets(large)),
+        ("packets(4096 B, MTU 247)", lambda: Packetizer(247).packets(large)),
+        ("pack(scene, MTU 247)", lambda: Packetizer(247).pack(commands)),
+    ]:
+        seconds = min(timeit.repeat(func, number=NUMBER, repeat=5))
+        print(f"{name:<26} {seconds / NUMBER * 1e9:10.1f} ns")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import enum
+import logging
+import os
+import sys
+import timeit
+from typing import Dict, List
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from classes import Response
+from logger import logger
+
+SIZES = [20, 64, 256, 1024, 4096, 8191, 16384, 65535]
+MTU_PAYLOAD = 20  # default ATT MTU of 23 minus the 3 byte ATT header
+
+
+class LegacyResponse:
+    # The implementation Response replaced, kept here for comparison
+    def __init__(self) -> None:
+        self.bytes_remaining = 0
+        self.bytes = bytearray()
+        self.data: Dict[int, bytes] = {}
+
+    @property
+    def is_received(self) -> bool:
+        return len(self.bytes) > 0 and self.bytes_remaining == 0
+
+    def accumulate(self, data: bytes) -> None:
+        CONT_MASK = 0b10000000
+        HDR_MASK = 0b01100000
+        GEN_LEN_MASK = 0b00011111
+        EXT_13_BYTE0_MASK = 0b00011111
+
+        class Header(enum.Enum):
+            GENERAL = 0b00
+            EXT_13 = 0b01
+            EXT_16 = 0b10
+            RESERVED = 0b11
+
+        buf = bytearray(data)
+        if buf[0] & CONT_MASK:
+            buf.pop(0)
+        else:
+            self.bytes = bytearray()
+            hdr = Header((buf[0] & HDR_MASK) >> 5)
+            if hdr is Header.GENERAL:
+                self.bytes_remaining = buf[0] & GEN_LEN_MASK
+                buf = buf[1:]
+            elif hdr is Header.EXT_13:
+                self.bytes_remaining = ((buf[0] & EXT_13_BYTE0_MASK) << 8) + buf[1]
+                buf = buf[2:]
+            elif hdr is Header.EXT_16:
+                self.bytes_remaining = (buf[1] << 8) + buf[2]
+                buf = buf[3:]
+        self.bytes.extend(buf)
+        self.bytes_remaining -= len(buf)
+
+    def parse(self) -> None:
+        self.id = self.bytes[0]
+        self.status = self.bytes[1]
+        buf = self.bytes[2:]
+        while len(buf) > 0:
+            param_id = buf[0]
+            param_len = buf[1]
+            buf = buf[2:]
+            self.data[param_id] = buf[:param_len]
+            buf = buf[param_len:]
+
+
+def payload(size: int) -> bytes:
+    # id, status, then TLV parameters of up to 16 bytes each
+    body = bytearray([0x20, 0x00])
+    param_id = 0
+    while len(body) + 2 < size:
+        length = min(16, size - len(body) - 2)
+        body += bytes([param_id & 0xFF, length]) + bytes(length)
+        param_id += 1
+    body += bytes(size - len(body))
+    return bytes(body)
+
+
+def fragment(message: bytes, mtu: int = MTU_PAYLOAD) -> List[bytes]:
+    size = len(message)
+    if size < 32:
+        header = bytes([size])
+    elif size < 8192:
+        header = bytes([0b00100000 | (size >> 8), size & 0xFF])
+    else:
+        header = bytes([0b01000000, size >> 8, size & 0xFF])
+    packets = [header + message[:mtu - len(header)]]
+    for i in range(mtu - len(header), size, mtu - 1):
+        packets.append(bytes([0b10000000]) + message[i:i + mtu - 1])
+    return packets
+
+
+def run(response, packets: List[bytes]) -> None:
+    for packet in packets:
+        response.accumulate(packet)
+    response.parse()
+
+
+def main() -> None:
+    logger.setLevel(logging.WARNING)
+    print(f"{'payload':>8} {'packets':>8} {'legacy':>12} {'Response':>12} {'speedup':>8}")
+    for size in SIZES:
+        message = payload(size)
+        packets = fragment(message)
+        legacy, response = LegacyResponse(), Response()
+        run(response, packets)
+        assert bytes(response.bytes) == message
+
+        number = max(1, 20_000 // len(packets))
+        legacy_time = min(timeit.repeat(lambda: run(legacy, packets), number=number, repeat=3)) / number
+        new_time = min(timeit.repeat(lambda: run(response, packets), number=number, repeat=3)) / number
+        print(f"{size:>8} {len(packets):>8} {legacy_time * 1e6:>10.1f}us {new_time * 1e6:>10.1f}us "
+              f"{legacy_time / new_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
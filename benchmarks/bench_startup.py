@@ -0,0 +1,64 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+BUDGET = 0.150  # seconds for `cli.py frame ...`, interpreter start included
+RUNS = 20
+# None of these may be imported by a command that doesn't talk to a device or open a window
+HEAVY = ("bleak", "rich", "tkinter", "textual", "plyer", "numpy")
+
+PROBE = """
+import sys
+sys.argv = ["cli.py"] + sys.argv[1:]
+import cli
+cli.main(sys.argv[1:])
+print(",".join(sorted(name for name in {heavy!r} if name in sys.modules)), file=sys.stderr)
+"""
+
+
+def run(argv) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(ROOT, "cli.py"), *argv], cwd=ROOT, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def heavy_imports(argv) -> str:
+    result = subprocess.run([sys.executable, "-c", PROBE.format(heavy=HEAVY), *argv], cwd=ROOT, check=True,
+                            capture_output=True, text=True)
+    return result.stderr.strip().splitlines()[-1] if result.stderr.strip() else ""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Checks that short CLI commands start within budget.")
+    parser.add_argument("--budget", type=float, default=BUDGET, help="seconds (default %(default)s)")
+    parser.add_argument("--runs", type=int, default=RUNS)
+    args = parser.parse_args()
+
+    baseline = statistics.median(_interpreter() for _ in range(args.runs))
+    failed = False
+    for argv in (["frame", "color", "255", "0", "0"], ["frame", "brightness", "50"], ["--help"]):
+        times = [run(argv) for _ in range(args.runs)]
+        median = statistics.median(times)
+        loaded = heavy_imports(argv) if argv[0] != "--help" else heavy_imports(["frame", "query"])
+        over = median > args.budget
+        failed |= over or bool(loaded)
+        print(f"{' '.join(argv):<28} median {median * 1000:6.1f}ms (python alone {baseline * 1000:.1f}ms)"
+              f"{'  OVER BUDGET' if over else ''}{'  loaded ' + loaded if loaded else ''}")
+    if failed:
+        sys.exit(1)
+
+
+def _interpreter() -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import timeit
+from typing import Callable, Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, '..'))
+sys.path.append(os.path.join(HERE, '..', 'application'))
+
+import frames
+from classes import Response
+from codes import codes
+from logger import logger
+from packetizer import fragment
+from bench_response import payload
+
+REPEAT = 5
+THRESHOLD = 0.10  # slower than the baseline by more than this fraction is a regression
+
+
+class Skip(Exception):
+    pass
+
+
+CASES: Dict[str, Callable[[], Callable[[int], None]]] = {}
+
+
+def case(name: str):
+    """Registers a setup function returning the operation to time (no arguments, run `number` times)."""
+    def register(setup: Callable[[], Callable[[], object]]):
+        def runner() -> Callable[[int], None]:
+            timer = timeit.Timer(setup())
+            return timer.timeit
+        CASES[name] = runner
+        return setup
+    return register
+
+
+def async_case(name: str):
+    """Like `case`, for a coroutine function; every timing batch runs in one event loop pass."""
+    def register(setup: Callable[[asyncio.AbstractEventLoop], Callable[[], object]]):
+        def runner() -> Callable[[int], None]:
+            loop = asyncio.new_event_loop()
+            operation = setup(loop)
+
+            async def batch(number: int) -> None:
+                for _ in range(number):
+                    await operation()
+
+            def run(number: int) -> float:
+                started = time.perf_counter()
+                loop.run_until_complete(batch(number))
+                return time.perf_counter() - started
+            return run
+        CASES[name] = runner
+        return setup
+    return register
+
+
+# Frame encoding
+
+@case("codes.color_copy")
+def _():
+    # What the code did before the frames module: copy the base frame and append the color
+    def encode():
+        frame = codes["colors"]["BASE"].copy()
+        frame.extend([0x12, 0x34, 0x56, 0x00])
+        return frame
+    return encode
+
+
+@case("frames.encode_color")
+def _():
+    return lambda: frames.encode_color(0x12, 0x34, 0x56)
+
+
+@case("frames.encode_brightness")
+def _():
+    return lambda: frames.encode_brightness(0x40)
+
+
+@case("utils.Color.as_bytearray")
+def _():
+    from utils import Color
+    color = Color(0x12, 0x34, 0x56)
+    return lambda: color.as_bytearray
+
+
+# Response reassembly
+
+def _reassembly(size: int, mtu_payload: int):
+    def setup():
+        packets = fragment(payload(size), mtu_payload)
+        response = Response()
+
+        def run():
+            for packet in packets:
+                response.accumulate(packet)
+            response.parse()
+        return run
+    return setup
+
+
+for _size in (20, 256, 4096, 65535):
+    for _mtu_payload in (20, 244):
+        case(f"Response.accumulate_parse[{_size}B/{_mtu_payload}B]")(_reassembly(_size, _mtu_payload))
+
+
+# Ember value codecs
+
+@case("utils.decode_temperature")
+def _():
+    from utils import decode_temperature
+    value = bytearray(b'\x8c\x0a')
+    return lambda: decode_temperature(value)
+
+
+@case("utils.encode_temperature")
+def _():
+    from utils import encode_temperature
+    return lambda: encode_temperature(27.0)
+
+
+@case("utils.parse_color")
+def _():
+    from utils import parse_color
+    value = bytearray(b'\x12\x34\x56\xff')
+    return lambda: parse_color(value)
+
+
+# Controller and GUI
+
+class StaticClient:
+    # Answers every read at once with a fixed value, so only the controller's own work is timed
+    address = "00:00:00:00:00:00"
+    services = None
+
+    def __init__(self):
+        from utils import Request
+        self.values = {
+            Request.Battery.as_uuid: bytearray(b'\x50\x01'),
+            Request.Temperature.as_uuid: bytearray(b'\x8c\x0a'),
+            Request.SettingTemperature.as_uuid: bytearray(b'\x8c\x0a'),
+            Request.State.as_uuid: bytearray(b'\x05'),
+            Request.LightColor.as_uuid: bytearray(b'\x12\x34\x56\xff'),
+        }
+
+    async def read_gatt_char(self, char, **_) -> bytearray:
+        return self.values[char]
+
+
+def _controller(loop: Optional[asyncio.AbstractEventLoop] = None):
+    try:
+        from controller import Controller
+    except ImportError as e:
+        raise Skip(f"controller needs {e.name}")
+    if loop is not None:
+        asyncio.set_event_loop(loop)
+    controller = Controller(StaticClient())
+    controller.running = True
+    return controller
+
+
+@async_case("Controller.notify_callback[temperature]")
+def _(loop):
+    from utils import NotificationValue
+    callback = _controller(loop).notify_callback()
+    data = bytearray([NotificationValue.TemperatureChange])
+    return lambda: callback(0, data)
+
+
+@async_case("Controller.notify_callback[battery]")
+def _(loop):
+    from utils import NotificationValue
+    callback = _controller(loop).notify_callback()
+    data = bytearray([NotificationValue.BatteryChargeChange])
+    return lambda: callback(0, data)
+
+
+def _application():
+    import tkinter as tk
+    controller = _controller()
+    try:
+        from gui import Application
+        root = tk.Tk()
+    except ImportError as e:
+        raise Skip(f"gui needs {e.name}")
+    except tk.TclError as e:
+        raise Skip(f"no display: {e}")
+    return Application(controller, root), controller
+
+
+@case("Application.update_[idle]")
+def _():
+    app, _ = _application()
+    return lambda: app.update_(set())
+
+
+@case("Application.update_[color]")
+def _():
+    from utils import Color
+    app, controller = _application()
+    controller.color = Color(0x12, 0x34, 0x56)
+    dirty = {'color'}
+    return lambda: app.update_(dirty)
+
+
+def measure(name: str) -> Optional[float]:
+    try:
+        run = CASES[name]()
+    except Skip as e:
+        print(f"{name:<48} skipped ({e})")
+        return None
+    # Enough iterations for 0.2s per repeat, like `python -m timeit`
+    number = 1
+    while run(number) < 0.2:
+        number *= 2
+    seconds = min(run(number) for _ in range(REPEAT)) / number
+    print(f"{name:<48} {seconds * 1e9:12.1f} ns/op")
+    return seconds * 1e9
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float) -> List[str]:
+    regressions = []
+    print(f"\n{'benchmark':<48} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = current / before - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<48} {before:10.1f}ns {current:10.1f}ns {change:+7.1%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Times the protocol and controller hot paths.")
+    parser.add_argument("-k", dest="pattern", help="only run benchmarks whose name contains this")
+    parser.add_argument("--save", metavar="JSON", help="write the results to this file")
+    parser.add_argument("--compare", metavar="JSON", help="compare against results saved earlier")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="fractional slowdown that counts as a regression (default %(default)s)")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    results: Dict[str, float] = {}
+    for name in CASES:
+        if args.pattern and args.pattern not in name:
+            continue
+        ns = measure(name)
+        if ns is not None:
+            results[name] = ns
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "timestamp": time.time(),
+                "unit": "ns/op",
+                "results": results,
+            }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Union
+
+import frames
+from classes import BytesLike, Response
+from logger import logger
+
+DEFAULT_TIMEOUT = 5.0
+
+
+class CommandChannel:
+    """Correlates outgoing commands with the responses notified back for them.
+
+    Every command waits in a slot keyed by the response id it expects (the
+    command's opcode unless told otherwise). Several commands can be in flight
+    at once; replies with the same id are handed out in the order sent.
+
+    A command that timed out or was cancelled after it was written may still
+    be answered. It keeps its place in the slot as a deadline, so its late
+    reply is dropped rather than handed to the next command with the same id;
+    if the reply hasn't come within another timeout it is taken as lost.
+    """
+
+    def __init__(self, write: Callable[[BytesLike], Awaitable[None]],
+                 is_response: Callable[[int], bool] = lambda _: True,
+                 timeout: float = DEFAULT_TIMEOUT) -> None:
+        self._write = write
+        self._is_response = is_response
+        self.timeout = timeout
+        # Waiting commands in the order written; a float is one given up on, until when its reply may still come
+        self._slots: Dict[int, Deque[Union[asyncio.Future, float]]] = {}
+        # Commands written to the light, with their timeouts
+        self._written: Dict[asyncio.Future, float] = {}
+        # One reassembler per notifying handle so interleaved fragments don't mix
+        self._responses: Dict[int, Response] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return sum(isinstance(waiter, asyncio.Future) for slot in self._slots.values() for waiter in slot)
+
+    def expect(self, response_id: int, timeout: Optional[float] = None) -> asyncio.Future:
+        timeout = self.timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        slot = self._slots.setdefault(response_id, deque())
+        slot.append(future)
+
+        def expire() -> None:
+            if not future.done():
+                future.set_exception(asyncio.TimeoutError(f"No response {response_id:#04x} within {timeout}s"))
+
+        def settled(_: asyncio.Future) -> None:
+            handle.cancel()
+            self._settle(response_id, future)
+
+        handle = loop.call_later(timeout, expire)
+        future.add_done_callback(settled)
+        return future
+
+    async def submit(self, data: BytesLike, response_id: Optional[int] = None,
+                     timeout: Optional[float] = None) -> asyncio.Future:
+        # Register before writing: the reply can arrive before write_gatt_char returns
+        future = self.expect(frames.opcode(data) if response_id is None else response_id, timeout)
+        self._written[future] = self.timeout if timeout is None else timeout
+        try:
+            await self._write(data)
+        except BaseException as e:
+            # Never went out, so no reply is coming for it
+            self._written.pop(future, None)
+            self._discard(future)
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+                raise
+            future.set_exception(e)
+        return future
+
+    async def send(self, data: BytesLike, response_id: Optional[int] = None,
+                   timeout: Optional[float] = None) -> Response:
+        return await (await self.submit(data, response_id, timeout))
+
+    def notify(self, handle: int, data: BytesLike) -> None:
+        response = self._responses.get(handle)
+        if response is None:
+            response = self._responses[handle] = Response()
+        response.accumulate(data)
+        if not response.is_received:
+            return
+
+        response.parse()
+        if not self._is_response(handle):
+            logger.error(f"Unexpected response on handle {handle}")
+            return
+        if response.status != 0:
+            logger.error(f"Response {response.id:#04x} failed with status {response.status}")
+
+        slot = self._slots.get(response.id)
+        now = asyncio.get_running_loop().time()
+        while slot:
+            waiter = slot[0]
+            if isinstance(waiter, asyncio.Future):
+                if not waiter.done():
+                    break
+                # Timed out or cancelled but not settled yet
+                self._settle(response.id, waiter)
+                continue
+            slot.popleft()
+            if waiter >= now:
+                logger.debug(f"Dropping late response {response.id:#04x} to a command that was given up on")
+                return
+        if not slot:
+            # e.g. replies to the handshake, which is written straight to the client
+            logger.debug(f"Dropping response {response.id:#04x} that nothing is waiting for")
+            return
+        # The reassembler is reused for the next message, so the waiter gets its own copy
+        slot.popleft().set_result(response.copy())
+
+    def close(self, exc: Optional[BaseException] = None) -> None:
+        for slot in self._slots.values():
+            while slot:
+                future = slot.popleft()
+                if isinstance(future, asyncio.Future) and not future.done():
+                    future.set_exception(exc or ConnectionError("Command channel closed"))
+        self._written.clear()
+        self._responses.clear()
+
+    def _settle(self, response_id: int, future: asyncio.Future) -> None:
+        # A waiter that was given up on leaves the slot; if it was written, its reply may still come
+        timeout = self._written.pop(future, None)
+        slot = self._slots.get(response_id)
+        if not slot or future not in slot:
+            # Answered, or taken out by close or a failed write
+            return
+        if timeout is None:
+            slot.remove(future)
+        else:
+            slot[slot.index(future)] = asyncio.get_running_loop().time() + timeout
+
+    def _discard(self, future: asyncio.Future) -> None:
+        for slot in self._slots.values():
+            if future in slot:
+                slot.remove(future)
+                return
@@ -1,73 +1,129 @@
 import enum
 import json
-from typing import Dict
+import logging
+from typing import Dict, Tuple
 
-from logger import logger
+from logger import logger, trace_logger
+
+reassembly = trace_logger("reassembly")
+
+CONT_MASK = 0b10000000
+HDR_MASK = 0b01100000
+GEN_LEN_MASK = 0b00011111
+EXT_13_BYTE0_MASK = 0b00011111
+
+
+class Header(enum.IntEnum):
+    GENERAL = 0b00
+    EXT_13 = 0b01
+    EXT_16 = 0b10
+    RESERVED = 0b11
+
+
+# Header bits as they appear in byte 0, so decoding is a plain int compare
+HDR_GENERAL = Header.GENERAL << 5
+HDR_EXT_13 = Header.EXT_13 << 5
+HDR_EXT_16 = Header.EXT_16 << 5
+
+INITIAL_CAPACITY = 64
+
+BytesLike = bytes | bytearray | memoryview
 
 
 class Response:
     def __init__(self) -> None:
         self.bytes_remaining = 0
-        self.bytes = bytearray()
-        self.data: Dict[int, bytes] = {}
+        self._buffer = bytearray(INITIAL_CAPACITY)
+        self._view = memoryview(self._buffer)
+        self._length = 0
+        # Views into the reassembly buffer, valid until the next message starts
+        self.data: Dict[int, memoryview] = {}
+        self.offsets: Dict[int, Tuple[int, int]] = {}
         self.id: int
         self.status: int
 
     def __str__(self) -> str:
         return json.dumps(self.data, indent=4, default=lambda x: x.hex(":"))
 
+    @property
+    def bytes(self) -> memoryview:
+        return self._view[:self._length]
+
     @property
     def is_received(self) -> bool:
-        return len(self.bytes) > 0 and self.bytes_remaining == 0
-
-    def accumulate(self, data: bytes) -> None:
-        CONT_MASK = 0b10000000
-        HDR_MASK = 0b01100000
-        GEN_LEN_MASK = 0b00011111
-        EXT_13_BYTE0_MASK = 0b00011111
-
-        class Header(enum.Enum):
-            GENERAL = 0b00
-            EXT_13 = 0b01
-            EXT_16 = 0b10
-            RESERVED = 0b11
-
-        buf = bytearray(data)
-        if buf[0] & CONT_MASK:
-            buf.pop(0)
+        return self._length > 0 and self.bytes_remaining == 0
+
+    def _reserve(self, size: int) -> None:
+        if size <= len(self._buffer):
+            return
+        # Outstanding views pin the old buffer, so grow by allocating rather than resizing
+        buffer = bytearray(max(size, 2 * len(self._buffer)))
+        buffer[:self._length] = self._view[:self._length]
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+
+    def accumulate(self, data: BytesLike) -> None:
+        packet = memoryview(data)
+        first = packet[0]
+        if first & CONT_MASK:
+            packet = packet[1:]
         else:
-            # This is a new packet so start with an empty byte array
-            self.bytes = bytearray()
-            hdr = Header((buf[0] & HDR_MASK) >> 5)
-            if hdr is Header.GENERAL:
-                self.bytes_remaining = buf[0] & GEN_LEN_MASK
-                buf = buf[1:]
-            elif hdr is Header.EXT_13:
-                self.bytes_remaining = ((buf[0] & EXT_13_BYTE0_MASK) << 8) + buf[1]
-                buf = buf[2:]
-            elif hdr is Header.EXT_16:
-                self.bytes_remaining = (buf[1] << 8) + buf[2]
-                buf = buf[3:]
+            # This is a new packet so start with an empty buffer
+            hdr = first & HDR_MASK
+            if hdr == HDR_GENERAL:
+                self.bytes_remaining = first & GEN_LEN_MASK
+                packet = packet[1:]
+            elif hdr == HDR_EXT_13:
+                self.bytes_remaining = ((first & EXT_13_BYTE0_MASK) << 8) | packet[1]
+                packet = packet[2:]
+            elif hdr == HDR_EXT_16:
+                self.bytes_remaining = (packet[1] << 8) | packet[2]
+                packet = packet[3:]
+            else:
+                logger.warning(f"Dropping packet with reserved header {first:#04x}")
+                return
+            self._length = 0
+            self.data = {}
+            self.offsets = {}
+            self._reserve(self.bytes_remaining)
 
         # Append payload to buffer and update remaining / complete
-        self.bytes.extend(buf)
-        self.bytes_remaining -= len(buf)
-        logger.info(f"{self.bytes_remaining=}")
+        size = len(packet)
+        end = self._length + size
+        self._reserve(end)
+        self._buffer[self._length:end] = packet
+        self._length = end
+        self.bytes_remaining -= size
+        if reassembly.isEnabledFor(logging.DEBUG):
+            reassembly.debug("bytes_remaining=%d", self.bytes_remaining)
 
     def parse(self) -> None:
-        self.id = self.bytes[0]
-        self.status = self.bytes[1]
-        buf = self.bytes[2:]
-        while len(buf) > 0:
+        buf = self._view
+        end = self._length
+        self.id = buf[0]
+        self.status = buf[1]
+        data: Dict[int, memoryview] = {}
+        offsets: Dict[int, Tuple[int, int]] = {}
+        pos = 2
+        while pos + 2 <= end:
             # Get ID and Length
-            param_id = buf[0]
-            param_len = buf[1]
-            buf = buf[2:]
-            # Get the value
-            value = buf[:param_len]
+            param_id = buf[pos]
+            start = pos + 2
+            pos = min(start + buf[pos + 1], end)
 
-            # Store in dict for later access
-            self.data[param_id] = value
+            # Store the value's location; the view is a window onto the buffer, not a copy
+            offsets[param_id] = (start, pos - start)
+            data[param_id] = buf[start:pos]
+        self.data = data
+        self.offsets = offsets
 
-            # Advance the buffer
-            buf = buf[param_len:]
+    def copy(self) -> "Response":
+        # Detached response with its own buffer, for handing a message off past the next accumulate
+        response = Response()
+        response._reserve(self._length)
+        response._buffer[:self._length] = self._view[:self._length]
+        response._length = self._length
+        response.bytes_remaining = self.bytes_remaining
+        if self.is_received:
+            response.parse()
+        return response
@@ -0,0 +1,191 @@
+# Command line entry point: `python cli.py <command> ...`
+# Only argparse and the standard library load up front; each command imports what it needs when it runs,
+# so printing a frame never loads bleak and nothing loads Tk or Textual unless it opens a window.
+import argparse
+import os
+import sys
+from typing import Callable, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _frame(args: argparse.Namespace) -> bytes:
+    import frames
+    if args.command == "color":
+        return bytes(frames.encode_color(*args.rgb))
+    if args.command == "brightness":
+        return bytes(frames.encode_brightness(args.percent))
+    if args.command == "power":
+        return bytes(frames.encode_power(args.state == "on"))
+    if args.command == "timer":
+        return bytes(frames.encode_timer(args.minutes))
+    from codes import codes
+    return bytes(codes["handshake"]["query"])
+
+
+def encode(args: argparse.Namespace) -> int:
+    print(_frame(args).hex(":"))
+    return 0
+
+
+def send(args: argparse.Namespace) -> int:
+    import asyncio
+    if args.daemon:
+        return send_via_daemon(args)
+    from main import connect_ble
+    from session import Session
+
+    client_factory: Optional[Callable] = None
+    scanner = None
+    if args.simulate:
+        from simulator import Simulator
+        simulator = Simulator([args.address])
+        client_factory, scanner = simulator.client_factory, simulator.scanner()
+
+    async def run() -> int:
+        kwargs = {"client_factory": client_factory} if client_factory else {}
+        session = Session(args.address, **kwargs)
+        session.attach(*await connect_ble(session.handler, scanner=scanner, address=args.address, **kwargs))
+        try:
+            response = await session.request(_frame(args), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            print(f"no response within {args.timeout}s", file=sys.stderr)
+            return 1
+        finally:
+            await session.disconnect()
+        for param_id, value in response.data.items():
+            print(f"{param_id:#04x} {bytes(value).hex(':')}")
+        return 0 if response.status == 0 else 2
+
+    return asyncio.run(run())
+
+
+def send_via_daemon(args: argparse.Namespace) -> int:
+    # Only the standard library is needed to talk to the daemon, bleak stays in the daemon
+    import asyncio
+    from daemon_client import DaemonClient
+
+    async def run() -> int:
+        async with DaemonClient(args.socket) as client:
+            replies = await client.request(_frame(args), None if args.all else args.address)
+        for reply in replies:
+            if reply.status == 0xFF:
+                print(f"{reply.address} failed: {reply.message.decode()}", file=sys.stderr)
+                continue
+            for param_id, value in reply.params.items():
+                print(f"{reply.address} {param_id:#04x} {value.hex(':')}")
+        return 0 if all(reply.ok for reply in replies) else 2
+
+    return asyncio.run(run())
+
+
+def daemon(args: argparse.Namespace) -> int:
+    import asyncio
+    from daemon import Daemon
+
+    kwargs = {}
+    if args.simulate:
+        from simulator import Simulator
+        simulator = Simulator(args.addresses)
+        kwargs = {"client_factory": simulator.client_factory, "scanner": simulator.scanner()}
+    asyncio.run(Daemon(args.addresses, args.socket, **kwargs).run())
+    return 0
+
+
+def scan(args: argparse.Namespace) -> int:
+    import asyncio
+    from scanner import Scanner
+
+    scanner = Scanner()
+    asyncio.run(scanner.find(args.addresses, timeout=args.timeout))
+    for address, sighting in sorted(scanner.sightings.items()):
+        print(f"{address} rssi={sighting.rssi} {sighting.device.name or ''}")
+    return 0
+
+
+def inspect(args: argparse.Namespace) -> int:
+    from recorder import Capture
+
+    with Capture(args.capture) as capture:
+        for event in capture:
+            print(f"{event.timestamp:12.6f} {event.direction.name:<6} {event.handle:#06x} {event.payload.hex(':')}")
+    return 0
+
+
+def gui(_: argparse.Namespace) -> int:
+    # The Tk application imports its modules relative to its own directory
+    sys.path.insert(0, os.path.join(HERE, "application"))
+    import runpy
+    runpy.run_path(os.path.join(HERE, "application", "main.py"), run_name="__main__")
+    return 0
+
+
+def tui(args: argparse.Namespace) -> int:
+    from textualgui import LightApp
+    LightApp(args.address).run()
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="mzds01", description="Control MZDS01 Bluetooth LED lights.")
+    commands = parser.add_subparsers(dest="action", required=True)
+
+    def add_device_commands(sub: argparse._SubParsersAction) -> None:
+        color = sub.add_parser("color", help="set the color")
+        color.add_argument("rgb", type=int, nargs=3, metavar=("R", "G", "B"))
+        brightness = sub.add_parser("brightness", help="set the brightness in percent")
+        brightness.add_argument("percent", type=int)
+        power = sub.add_parser("power", help="turn the light on or off")
+        power.add_argument("state", choices=("on", "off"))
+        timer = sub.add_parser("timer", help="turn off after this many minutes")
+        timer.add_argument("minutes", type=int)
+        sub.add_parser("query", help="ask the light for its state")
+
+    frame = commands.add_parser("frame", help="print the frame a command would send, without a device")
+    frame.set_defaults(func=encode)
+    add_device_commands(frame.add_subparsers(dest="command", required=True))
+
+    send_parser = commands.add_parser("send", help="send a command to a light and print its response")
+    send_parser.set_defaults(func=send)
+    send_parser.add_argument("--address", default=_default_address())
+    send_parser.add_argument("--timeout", type=float, default=5.0)
+    send_parser.add_argument("--simulate", action="store_true", help="talk to a simulated light instead")
+    send_parser.add_argument("--daemon", action="store_true", help="go through a running `daemon`")
+    send_parser.add_argument("--all", action="store_true", help="with --daemon, send to every light it holds")
+    send_parser.add_argument("--socket", help="daemon socket (default: $MZDS01_SOCKET or a per-user path)")
+    add_device_commands(send_parser.add_subparsers(dest="command", required=True))
+
+    daemon_parser = commands.add_parser("daemon", help="stay connected to lights and take commands on a socket")
+    daemon_parser.set_defaults(func=daemon)
+    daemon_parser.add_argument("addresses", nargs="+")
+    daemon_parser.add_argument("--socket", help="where to listen (default: $MZDS01_SOCKET or a per-user path)")
+    daemon_parser.add_argument("--simulate", action="store_true", help="hold simulated lights instead")
+
+    scan_parser = commands.add_parser("scan", help="list advertising devices")
+    scan_parser.set_defaults(func=scan)
+    scan_parser.add_argument("--timeout", type=float, default=5.0)
+    scan_parser.add_argument("addresses", nargs="*", help="stop as soon as these have been seen")
+
+    inspect_parser = commands.add_parser("inspect", help="print the events in a traffic capture")
+    inspect_parser.set_defaults(func=inspect)
+    inspect_parser.add_argument("capture")
+
+    commands.add_parser("gui", help="open the Tk controller").set_defaults(func=gui)
+    tui_parser = commands.add_parser("tui", help="open the terminal UI")
+    tui_parser.set_defaults(func=tui)
+    tui_parser.add_argument("--address", default=_default_address())
+    return parser
+
+
+def _default_address() -> str:
+    from codes import BLUETOOTH_ADDRESS
+    return BLUETOOTH_ADDRESS
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+import frames
+from classes import BytesLike
+from logger import logger
+from metrics import metrics
+
+MIN_INTERVAL = 0.05  # at most 20 frames/s of any one kind
+
+
+class Coalescer:
+    """Latest-wins command slots, one per command kind.
+
+    `submit` is synchronous so UI callbacks can call it directly. Each kind
+    keeps only its newest pending frame and has at most one task draining it,
+    spaced at least `min_interval` apart, so a burst of slider events turns
+    into a handful of writes that end on the final value.
+    """
+
+    def __init__(self, send: Callable[[bytes], Awaitable[None]], min_interval: float = MIN_INTERVAL):
+        self._send = send
+        self.min_interval = min_interval
+        self._pending: Dict[Hashable, bytes] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._last_sent: Dict[Hashable, float] = {}
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+
+    @property
+    def coalesced(self) -> int:
+        # Frames that were replaced by a newer one before they went out
+        return self.submitted - self.sent - self.failed - len(self._pending)
+
+    def submit(self, frame: BytesLike, kind: Optional[Hashable] = None) -> None:
+        kind = frames.opcode(frame) if kind is None else kind
+        if kind in self._pending:
+            metrics.inc("commands_coalesced")
+        # Copy, since encoder views are overwritten by the next encode
+        self._pending[kind] = bytes(frame)
+        self.submitted += 1
+        if kind not in self._tasks:
+            self._tasks[kind] = asyncio.get_running_loop().create_task(self._drain(kind))
+
+    async def _drain(self, kind: Hashable) -> None:
+        try:
+            while kind in self._pending:
+                wait = self._last_sent.get(kind, 0.0) + self.min_interval - time.monotonic()
+                if wait > 0:
+                    # Anything submitted while sleeping replaces the pending frame
+                    await asyncio.sleep(wait)
+                frame = self._pending.pop(kind)
+                self._last_sent[kind] = time.monotonic()
+                try:
+                    await self._send(frame)
+                    self.sent += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.warning(f"Sending coalesced {kind!r} frame failed: {e!r}")
+        finally:
+            del self._tasks[kind]
+
+    async def flush(self) -> None:
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def close(self) -> None:
+        self._pending.clear()
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
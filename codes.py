@@ -1,5 +1,6 @@
 BLUETOOTH_ADDRESS = "EC1FF10F-D43D-3B21-9D77-D6CBC851E5EC"
 RESPONSE_UUID = "fa879af4-d601-420c-b2b4-07ffb528dde3"  # QUERY_RSP_UUID
+CONTROL_UUID = "b02eaeaa-f6bc-4a7e-bc94-f7b7fc8ded0b"  # command writes go here
 
 codes: dict[str, dict[str, bytearray]] = {
     "colors": {
@@ -21,5 +22,12 @@ codes: dict[str, dict[str, bytearray]] = {
     },
     "timer": {
         "custom": bytearray([0xFE, 0x01, 0x00, 0x05, 0x30, 0x03, 0x00, 0x3C]) ## append 00 to 3c for number of minutes (max 1hr)
+    },
+    "datetime": {
+        "sync": bytearray([0xFE, 0x01, 0x00, 0x10, 0x50, 0x01]) # append local time as ascii YYYYmmddHHMMSS
+    },
+    "handshake": {
+        "hello": bytearray([0xFE, 0x01, 0x00, 0x02, 0x50, 0x11]),
+        "query": bytearray([0xFE, 0x01, 0x00, 0x02, 0x30, 0x04]),
     }
-}
\ No newline at end of file
+}
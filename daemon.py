@@ -0,0 +1,118 @@
+import asyncio
+import os
+import signal
+from typing import Iterable, List, Optional
+
+from bleak import BleakClient
+
+from daemon_client import Reply, STATUS_FAILED, pack_reply, read_message, request_id_of, socket_path, unpack_request
+from fleet import COMMAND_TIMEOUT, Fleet
+from logger import logger
+from metrics import metrics
+from scanner import Scanner
+from session import ClientFactory
+
+
+class Daemon:
+    """Keeps the configured lights connected and runs commands for clients on a Unix socket.
+
+    The scan, connect and handshake happen once at start-up; after that a
+    command costs a socket round trip plus the BLE write. Each client
+    connection may pipeline requests, and they run concurrently.
+    """
+
+    def __init__(self, addresses: Iterable[str], path: Optional[str] = None,
+                 client_factory: ClientFactory = BleakClient, scanner: Optional[Scanner] = None,
+                 timeout: float = COMMAND_TIMEOUT):
+        self.path = path or socket_path()
+        self.timeout = timeout
+        self.fleet = Fleet(addresses, client_factory=client_factory, scanner=scanner or Scanner(), supervise=True)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._stopped = asyncio.Event()
+
+    async def start(self) -> None:
+        results = await self.fleet.connect()
+        connected = [address for address, result in results.items() if result.ok]
+        logger.info(f"Connected to {len(connected)} of {len(results)} lights"
+                    f"{', reconnecting the rest in the background' if len(connected) < len(results) else ''}")
+
+        if os.path.exists(self.path):
+            # Left behind by a daemon that didn't shut down cleanly
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, self.path)
+        os.chmod(self.path, 0o600)
+        logger.info(f"Listening on {self.path}")
+
+    async def run(self) -> None:
+        await self.start()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._stopped.set)
+        try:
+            await self._stopped.wait()
+        finally:
+            await self.stop()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        await self.fleet.disconnect()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        tasks = set()
+        try:
+            while True:
+                body = await read_message(reader)
+                task = asyncio.create_task(self._handle(body, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    async def _handle(self, body: bytes, writer: asyncio.StreamWriter) -> None:
+        request_id = request_id_of(body)
+        address = None
+        with metrics.timer("daemon_request"):
+            try:
+                request_id, response, address, frame = unpack_request(body)
+                replies = await self._run(frame, address, response)
+                message = pack_reply(request_id, replies)
+            except KeyError:
+                message = pack_reply(request_id, [Reply(address or "", STATUS_FAILED, b"not a configured light")])
+            except Exception as e:
+                # Whatever went wrong, the client is waiting on this id
+                logger.warning(f"Daemon request {request_id} failed: {e!r}")
+                if request_id is None:
+                    # Too short to carry an id; hanging up fails whatever the client is waiting on
+                    writer.close()
+                    return
+                message = pack_reply(request_id, [Reply(address or "", STATUS_FAILED, repr(e).encode()[:0xFFFF])])
+        try:
+            writer.write(message)
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _run(self, frame: bytes, address: Optional[str], response: bool) -> List[Reply]:
+        target = None if address is None else [address]
+        results = await self.fleet.broadcast(frame, target, expect_response=response, timeout=self.timeout)
+        replies = []
+        for result in results.values():
+            if not result.ok:
+                replies.append(Reply(result.address, STATUS_FAILED, repr(result.error).encode()[:0xFFFF]))
+            elif response:
+                replies.append(Reply(result.address, result.value.status, bytes(result.value.bytes)))
+            else:
+                replies.append(Reply(result.address, 0, b""))
+        return replies
+
+    def __repr__(self):
+        return 'Daemon(path={!r}, lights={!r})'.format(self.path, len(self.fleet.sessions))
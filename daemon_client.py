@@ -0,0 +1,173 @@
+import asyncio
+import os
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Wire format on the daemon's Unix socket. Every message is a big-endian u32 length followed by its body.
+#   request  u32 id, u8 flags, u8 address length, address (empty for every light), MZDS01 command frame
+#   reply    u32 id, u8 count, then per light: u8 address length, address, u8 status, u16 length, message
+# The status is the light's Response status, or STATUS_FAILED when it could not be reached or did not
+# answer, in which case the message is the error text. Requests may be pipelined; replies come back
+# as they complete, matched up by id; a request that can't be run still gets a reply, with STATUS_FAILED.
+LENGTH = struct.Struct(">I")
+REQUEST = struct.Struct(">IBB")
+REPLY = struct.Struct(">IB")
+RESULT = struct.Struct(">B")
+MESSAGE = struct.Struct(">H")
+
+FLAG_RESPONSE = 0x01  # wait for the light's response instead of just the write
+STATUS_FAILED = 0xFF
+MAX_MESSAGE = 16 << 20  # far above any real reply; a larger length means the stream is out of sync
+
+
+def socket_path() -> str:
+    path = os.environ.get("MZDS01_SOCKET")
+    if path:
+        return path
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, "mzds01.sock")
+    return f"/tmp/mzds01-{os.getuid()}.sock"
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    if length > MAX_MESSAGE:
+        raise ConnectionError(f"{length} byte message is over the {MAX_MESSAGE} byte limit")
+    return await reader.readexactly(length)
+
+
+def pack_message(body: bytes) -> bytes:
+    return LENGTH.pack(len(body)) + body
+
+
+def pack_request(request_id: int, frame: bytes, address: Optional[str] = None, response: bool = True) -> bytes:
+    address_bytes = (address or "").encode()
+    return pack_message(REQUEST.pack(request_id, FLAG_RESPONSE if response else 0, len(address_bytes))
+                        + address_bytes + frame)
+
+
+def request_id_of(body: bytes) -> Optional[int]:
+    # Enough of a malformed request to answer it: the id is its first field
+    return int.from_bytes(body[:4], "big") if len(body) >= 4 else None
+
+
+def unpack_request(body: bytes) -> Tuple[int, bool, Optional[str], bytes]:
+    request_id, flags, address_length = REQUEST.unpack_from(body)
+    start = REQUEST.size
+    address = body[start:start + address_length].decode() or None
+    return request_id, bool(flags & FLAG_RESPONSE), address, body[start + address_length:]
+
+
+class Reply:
+    def __init__(self, address: str, status: int, message: bytes):
+        self.address = address
+        self.status = status
+        self.message = message
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 0
+
+    @property
+    def params(self) -> Dict[int, bytes]:
+        # The light's response is id, status, then id/length/value parameters
+        params = {}
+        pos = 2
+        while self.status != STATUS_FAILED and pos + 2 <= len(self.message):
+            start = pos + 2
+            end = start + self.message[pos + 1]
+            params[self.message[pos]] = self.message[start:end]
+            pos = end
+        return params
+
+    def __repr__(self):
+        return 'Reply(address={!r}, status={!r}, message={!r})'.format(self.address, self.status, self.message)
+
+
+def pack_reply(request_id: int, results: Sequence[Reply]) -> bytes:
+    parts = [REPLY.pack(request_id, len(results))]
+    for result in results:
+        address = result.address.encode()
+        parts += [bytes([len(address)]), address, RESULT.pack(result.status),
+                  MESSAGE.pack(len(result.message)), result.message]
+    return pack_message(b"".join(parts))
+
+
+def unpack_reply(body: bytes) -> Tuple[int, List[Reply]]:
+    request_id, count = REPLY.unpack_from(body)
+    pos = REPLY.size
+    results = []
+    for _ in range(count):
+        address_length = body[pos]
+        address = body[pos + 1:pos + 1 + address_length].decode()
+        pos += 1 + address_length
+        (status,) = RESULT.unpack_from(body, pos)
+        (length,) = MESSAGE.unpack_from(body, pos + RESULT.size)
+        pos += RESULT.size + MESSAGE.size
+        results.append(Reply(address, status, body[pos:pos + length]))
+        pos += length
+    return request_id, results
+
+
+class DaemonClient:
+    """Thin client for the connection daemon; needs nothing beyond the standard library."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or socket_path()
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._waiting: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._receiving: Optional[asyncio.Task] = None
+
+    async def connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._receiving = asyncio.create_task(self._receive())
+
+    async def request(self, frame: bytes, address: Optional[str] = None, response: bool = True) -> List[Reply]:
+        return (await self.batch([(frame, address)], response))[0]
+
+    async def batch(self, commands: Sequence[Tuple[bytes, Optional[str]]], response: bool = True) -> List[List[Reply]]:
+        # One socket write for the whole batch; the daemon works on all of them at once
+        if self._writer is None:
+            await self.connect()
+        loop = asyncio.get_running_loop()
+        futures = []
+        chunks = []
+        for frame, address in commands:
+            self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+            future = self._waiting[self._next_id] = loop.create_future()
+            futures.append(future)
+            chunks.append(pack_request(self._next_id, bytes(frame), address, response))
+        self._writer.write(b"".join(chunks))
+        await self._writer.drain()
+        return list(await asyncio.gather(*futures))
+
+    async def _receive(self) -> None:
+        try:
+            while True:
+                request_id, results = unpack_reply(await read_message(self._reader))
+                future = self._waiting.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(results)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            for future in self._waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"Daemon closed the connection: {e}"))
+            self._waiting.clear()
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+        if self._receiving is not None:
+            await self._receiving
+        self._writer = None
+
+    async def __aenter__(self) -> "DaemonClient":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
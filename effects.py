@@ -0,0 +1,166 @@
+import asyncio
+import math
+import time
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # effects are optional, nothing else needs NumPy
+    np = None
+
+import frames
+from classes import BytesLike
+from logger import logger
+
+if TYPE_CHECKING:
+    from application.utils import Color
+
+FPS = 25.0
+LATENCY_SMOOTHING = 0.2  # weight of the newest write latency in the running average
+
+RGB = Tuple[int, int, int]
+ColorLike = Union[RGB, "Color"]
+
+
+def _rgb(color: ColorLike) -> "np.ndarray":
+    # The application's Color or a plain (r, g, b) tuple; Color's alpha is not sent to the light
+    if hasattr(color, "r"):
+        return np.array((color.r, color.g, color.b))
+    return np.array(color)
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("Effects need NumPy, install it with `poetry install -E effects`")
+
+
+def _encode(encoder: frames.FrameEncoder, payload: "np.ndarray") -> "np.ndarray":
+    # One row per frame: the encoder's fixed prefix followed by the payload columns
+    rows = np.zeros((len(payload), encoder.size), dtype=np.uint8)
+    rows[:, :encoder.offset] = np.frombuffer(encoder.prefix, dtype=np.uint8)
+    rows[:, encoder.offset:encoder.offset + payload.shape[1]] = payload
+    return rows
+
+
+class Effect:
+    """A precomputed sequence of color and/or brightness frames, ready to stream at `fps`."""
+
+    def __init__(self, colors: Optional["np.ndarray"] = None, brightness: Optional["np.ndarray"] = None,
+                 fps: float = FPS, loop: bool = False):
+        _require_numpy()
+        if colors is None and brightness is None:
+            raise ValueError("An effect needs colors, brightness or both")
+        self.fps = fps
+        self.loop = loop
+        self.colors = None if colors is None else _encode(
+            frames.COLOR, np.clip(np.rint(colors), 0, 255).astype(np.uint8))
+        self.brightness = None if brightness is None else _encode(
+            frames.BRIGHTNESS, np.clip(np.rint(brightness), 0, frames.MAX_BRIGHTNESS).astype(np.uint8)[:, None])
+        self.length = len(self.colors) if self.colors is not None else len(self.brightness)
+
+    def __len__(self):
+        return self.length
+
+    def frames_at(self, i: int) -> Tuple[Optional[memoryview], Optional[memoryview]]:
+        # Zero-copy views of the precomputed rows
+        i %= self.length
+        color = None if self.colors is None else memoryview(self.colors[i])
+        brightness = None if self.brightness is None else memoryview(self.brightness[i])
+        return color, brightness
+
+    def __repr__(self):
+        return 'Effect(frames={!r}, fps={!r}, loop={!r})'.format(self.length, self.fps, self.loop)
+
+
+def _steps(duration: float, fps: float) -> int:
+    return max(1, round(duration * fps))
+
+
+def fade(start: ColorLike, end: ColorLike, duration: float, fps: float = FPS) -> Effect:
+    _require_numpy()
+    t = np.linspace(0.0, 1.0, _steps(duration, fps))[:, None]
+    return Effect(colors=(1 - t) * _rgb(start) + t * _rgb(end), fps=fps)
+
+
+def breathing(color: ColorLike, period: float = 4.0, low: int = 5, high: int = frames.MAX_BRIGHTNESS,
+              fps: float = FPS) -> Effect:
+    _require_numpy()
+    t = np.arange(_steps(period, fps)) / fps
+    level = low + (high - low) * (1 - np.cos(2 * math.pi * t / period)) / 2
+    return Effect(colors=np.tile(_rgb(color), (len(t), 1)), brightness=level, fps=fps, loop=True)
+
+
+def rainbow(period: float = 10.0, fps: float = FPS) -> Effect:
+    _require_numpy()
+    h = np.arange(_steps(period, fps)) / _steps(period, fps) * 6
+    # Fully saturated HSV -> RGB, one column per channel
+    rgb = np.stack([np.abs(h - 3) - 1, 2 - np.abs(h - 2), 2 - np.abs(h - 4)], axis=1)
+    return Effect(colors=np.clip(rgb, 0, 1) * 255, fps=fps, loop=True)
+
+
+def strobe(color: ColorLike, hz: float = 5.0, fps: float = FPS) -> Effect:
+    _require_numpy()
+    # Whole frames only: one cycle is on for half of it, off for the rest
+    cycle = max(2, round(fps / hz))
+    on = (np.arange(cycle) < cycle / 2)[:, None]
+    return Effect(colors=np.where(on, _rgb(color), 0), fps=fps, loop=True)
+
+
+class Player:
+    """Streams an effect at its frame rate on a drift-free absolute schedule.
+
+    Each write is awaited before the next frame, so no backlog ever builds.
+    When the average write latency exceeds a frame period only every n-th
+    frame is sent, if it still falls behind it skips to the frame that is due
+    now, and frames identical to the last one sent are not written again.
+    """
+
+    def __init__(self, send: Callable[[BytesLike], Awaitable[None]]):
+        self._send = send
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.latency = 0.0
+        self._stopped = asyncio.Event()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    async def play(self, effect: Effect, duration: Optional[float] = None) -> None:
+        self._stopped.clear()
+        period = 1 / effect.fps
+        started = time.monotonic()
+        last: Sequence[Optional[bytes]] = (None, None)
+        i = 0
+        while not self._stopped.is_set():
+            if not effect.loop and i >= len(effect):
+                break
+            due = started + i * period
+            if duration is not None and due - started >= duration:
+                break
+            now = time.monotonic()
+            if now < due:
+                await asyncio.sleep(due - now)
+            elif now - due >= period:
+                # Behind schedule: jump to the frame that is due now instead of catching up
+                late = int((now - due) / period)
+                self.frames_dropped += late
+                i += late
+                continue
+
+            sent = []
+            for frame, previous in zip(effect.frames_at(i), last):
+                if frame is None or frame == previous:
+                    sent.append(previous)
+                    continue
+                write_started = time.monotonic()
+                await self._send(frame)
+                self.latency += LATENCY_SMOOTHING * (time.monotonic() - write_started - self.latency)
+                sent.append(bytes(frame))
+            last = sent
+            self.frames_sent += 1
+            # Writes slower than the frame period: thin the stream up front rather than fall behind
+            stride = max(1, math.ceil(self.latency / period))
+            self.frames_dropped += stride - 1
+            i += stride
+        logger.info(f"Effect finished: {self.frames_sent} frames sent, {self.frames_dropped} dropped, "
+                    f"average write latency {self.latency * 1000:.1f}ms")
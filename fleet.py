@@ -0,0 +1,120 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from bleak import BleakClient
+from bleak.backends.device import BLEDevice as BleakDevice
+
+from classes import BytesLike
+from logger import logger
+from pipeline import DEFAULT_WINDOW
+from profile_cache import ProfileCache
+from scanner import Scanner, backoff
+from scenes import SCENE_TIMEOUT, Scene, apply
+from session import ClientFactory, Session
+
+MAX_CONCURRENT_CONNECTS = 4  # most adapters start failing connects beyond a handful at once
+CONNECT_ATTEMPTS = 3
+COMMAND_TIMEOUT = 5.0
+
+
+class CommandResult:
+    def __init__(self, address: str, ok: bool, latency: float, value: object = None,
+                 error: Optional[BaseException] = None):
+        self.address = address
+        self.ok = ok
+        self.latency = latency
+        self.value = value
+        self.error = error
+
+    def __repr__(self):
+        return 'CommandResult(address={!r}, ok={!r}, latency={:.3f}s, error={!r})'.format(
+            self.address, self.ok, self.latency, self.error)
+
+
+class Fleet:
+    """Owns a session per light and fans commands out to all of them, or to a named group, in parallel."""
+
+    def __init__(self, addresses: Iterable[str], max_concurrent_connects: int = MAX_CONCURRENT_CONNECTS,
+                 client_factory: ClientFactory = BleakClient, scanner: Optional[Scanner] = None,
+                 profiles: Optional[ProfileCache] = None, window: int = DEFAULT_WINDOW, supervise: bool = False):
+        profiles = profiles or ProfileCache()
+        self.sessions: Dict[str, Session] = {
+            address.upper(): Session(address, profiles, client_factory, window) for address in addresses}
+        self.groups: Dict[str, Set[str]] = {}
+        self.scanner = scanner
+        self.supervise = supervise
+        self._connect_slots = asyncio.Semaphore(max_concurrent_connects)
+
+    def add_group(self, name: str, addresses: Iterable[str]) -> None:
+        members = {address.upper() for address in addresses}
+        unknown = members - self.sessions.keys()
+        if unknown:
+            raise KeyError(f"Not in the fleet: {', '.join(sorted(unknown))}")
+        self.groups[name] = members
+
+    def select(self, target: Optional[str | Iterable[str]] = None) -> List[Session]:
+        # None is the whole fleet, a string names a group, anything else is a list of addresses
+        if target is None:
+            return list(self.sessions.values())
+        if isinstance(target, str):
+            return [self.sessions[address] for address in self.groups[target]]
+        return [self.sessions[address.upper()] for address in target]
+
+    async def connect(self, attempts: int = CONNECT_ATTEMPTS) -> Dict[str, CommandResult]:
+        devices: Dict[str, BleakDevice] = {}
+        if self.scanner is not None:
+            # One scan for the whole fleet; it stops as soon as every light has advertised
+            devices = await self.scanner.find(self.sessions.keys())
+        return await self._gather(self.select(), lambda session: self._connect(
+            session, devices.get(session.address.upper()), attempts))
+
+    async def _connect(self, session: Session, device: Optional[BleakDevice], attempts: int) -> None:
+        for attempt in range(attempts):
+            async with self._connect_slots:
+                try:
+                    await session.connect(device)
+                    if self.supervise:
+                        session.supervise()
+                    return
+                except Exception as e:
+                    logger.warning(f"Connecting to {session.address} failed (attempt {attempt + 1}): {e}")
+                    if attempt == attempts - 1:
+                        if self.supervise:
+                            # Still reported as failed, but the supervisor keeps reconnecting it
+                            session.supervise(online=False)
+                        raise
+            # Back off outside the semaphore so other lights can use the slot meanwhile
+            await asyncio.sleep(backoff(attempt))
+
+    async def broadcast(self, data: BytesLike, target: Optional[str | Iterable[str]] = None,
+                        expect_response: bool = False, timeout: float = COMMAND_TIMEOUT) -> Dict[str, CommandResult]:
+        # Encoder views are reused, so freeze the frame once before it fans out
+        data = bytes(data)
+        if expect_response:
+            return await self._gather(self.select(target), lambda session: session.request(data, timeout), timeout)
+        return await self._gather(self.select(target), lambda session: session.send(data), timeout)
+
+    async def apply_scene(self, scene: Scene, target: Optional[str | Iterable[str]] = None,
+                          timeout: float = SCENE_TIMEOUT) -> Dict[str, CommandResult]:
+        # Each light gets only what it is missing and rolls back on its own if part of it fails
+        return await self._gather(self.select(target), lambda session: apply(session, scene, timeout))
+
+    async def disconnect(self) -> None:
+        await asyncio.gather(*(session.disconnect() for session in self.sessions.values()), return_exceptions=True)
+
+    async def _gather(self, sessions: List[Session], command: Callable[[Session], Awaitable[object]],
+                      timeout: Optional[float] = None) -> Dict[str, CommandResult]:
+        async def run(session: Session) -> CommandResult:
+            started = time.monotonic()
+            try:
+                value = await asyncio.wait_for(command(session), timeout)
+            except Exception as e:
+                return CommandResult(session.address, False, time.monotonic() - started, error=e)
+            return CommandResult(session.address, True, time.monotonic() - started, value)
+
+        results = await asyncio.gather(*(run(session) for session in sessions))
+        failed = [result.address for result in results if not result.ok]
+        if failed:
+            logger.warning(f"{len(failed)} of {len(results)} lights failed: {', '.join(failed)}")
+        return {result.address: result for result in results}
@@ -0,0 +1,98 @@
+import struct
+from datetime import datetime
+from typing import Optional
+
+from codes import codes
+
+# Every command frame is FE 01 00 <len> <opcode> <sub> [payload...], where <len>
+# counts the bytes after the length byte. The prefixes live in the codes table.
+LENGTH_OFFSET = 3
+OPCODE_OFFSET = 4
+
+OP_POWER = 0x00
+OP_BRIGHTNESS = 0x10
+OP_COLOR = 0x20
+OP_TIMER = 0x30
+OP_SYSTEM = 0x50
+
+MAX_BRIGHTNESS = 0x64
+MAX_TIMER_MINUTES = 0x3C
+
+
+class FrameEncoder:
+    """Writes one command into a preallocated buffer and hands out a view of it.
+
+    The returned memoryview is reused by the next encode, so it must be written
+    (or copied with `bytes()`) before the same encoder is used again.
+    """
+
+    def __init__(self, prefix: bytes | bytearray, payload_format: str = "") -> None:
+        self.prefix = bytes(prefix)
+        self.payload = struct.Struct(">" + payload_format)
+        self.offset = len(self.prefix)
+        self.size = self.offset + self.payload.size
+        if self.prefix[LENGTH_OFFSET] != self.size - LENGTH_OFFSET - 1:
+            raise ValueError(f"Length byte of {self.prefix.hex(':')} does not match a {payload_format!r} payload")
+
+        self.buffer = bytearray(self.size)
+        self.buffer[:self.offset] = self.prefix
+        self.view = memoryview(self.buffer)
+
+    @property
+    def opcode(self) -> int:
+        return self.prefix[OPCODE_OFFSET]
+
+    def encode(self, *values) -> memoryview:
+        self.payload.pack_into(self.buffer, self.offset, *values)
+        return self.view
+
+    def __repr__(self):
+        return 'FrameEncoder(prefix={!r}, payload={!r})'.format(self.prefix.hex(':'), self.payload.format)
+
+
+def _compile_value(encoder: FrameEncoder, name: str, maximum: int):
+    # fixed-arity closure over the bound pack_into: no attribute lookups or *args packing per frame
+    pack_into, buffer, offset, view = encoder.payload.pack_into, encoder.buffer, encoder.offset, encoder.view
+
+    def encode(value: int) -> memoryview:
+        if not 0 <= value <= maximum:
+            raise ValueError(f"{name} must be between 0 and {maximum}, got {value}")
+        pack_into(buffer, offset, value)
+        return view
+
+    return encode
+
+
+def _compile_color(encoder: FrameEncoder):
+    pack_into, buffer, offset, view = encoder.payload.pack_into, encoder.buffer, encoder.offset, encoder.view
+
+    def encode(r: int, g: int, b: int) -> memoryview:
+        pack_into(buffer, offset, r, g, b)
+        return view
+
+    return encode
+
+
+POWER = FrameEncoder(codes["colors"]["OFF"][:-1], "B")
+COLOR = FrameEncoder(codes["colors"]["BASE"], "BBBx")
+BRIGHTNESS = FrameEncoder(codes["brightness"]["custom"], "B")
+TIMER = FrameEncoder(codes["timer"]["custom"], "B")
+DATETIME = FrameEncoder(codes["datetime"]["sync"], "14s")
+
+_encode_power = _compile_value(POWER, "Power", 1)
+encode_color = _compile_color(COLOR)
+encode_brightness = _compile_value(BRIGHTNESS, "Brightness", MAX_BRIGHTNESS)
+encode_timer = _compile_value(TIMER, "Timer", MAX_TIMER_MINUTES)
+
+
+def opcode(frame: bytes | bytearray | memoryview) -> int:
+    return frame[OPCODE_OFFSET]
+
+
+def encode_power(on: bool) -> memoryview:
+    return _encode_power(1 if on else 0)
+
+
+def encode_datetime(when: Optional[datetime] = None) -> memoryview:
+    when = when or datetime.now()
+    return DATETIME.encode(when.strftime("%Y%m%d%H%M%S").encode())
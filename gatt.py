@@ -0,0 +1,70 @@
+from typing import Dict, FrozenSet, List, Optional
+
+from bleak.backends.characteristic import BleakGATTCharacteristic
+from bleak.backends.service import BleakGATTServiceCollection
+
+from codes import CONTROL_UUID, RESPONSE_UUID
+from logger import logger
+
+WRITE_PROPERTIES = ("write", "write-without-response")
+
+
+def is_vendor(char: BleakGATTCharacteristic) -> bool:
+    # Standard Bluetooth SIG characteristics all live under 0000xxxx-0000-1000-8000-00805f9b34fb
+    return char.uuid[0] != "0"
+
+
+def is_writable(char: BleakGATTCharacteristic) -> bool:
+    return any(prop in char.properties for prop in WRITE_PROPERTIES)
+
+
+class CharacteristicIndex:
+    """Walks the services once after connect and remembers which characteristics matter.
+
+    `control` is the one characteristic commands are written to and
+    `response_handles` are the handles the device answers on, so neither
+    writes nor notifications have to search the service tree again.
+    """
+
+    def __init__(self, services: BleakGATTServiceCollection,
+                 control_uuid: str = CONTROL_UUID, response_uuid: str = RESPONSE_UUID) -> None:
+        self.by_handle: Dict[int, BleakGATTCharacteristic] = dict(services.characteristics)
+        chars = sorted(self.by_handle.values(), key=lambda char: char.handle)
+
+        self.notify: List[BleakGATTCharacteristic] = [
+            char for char in chars if "notify" in char.properties and is_vendor(char)]
+        self.readable: List[BleakGATTCharacteristic] = [char for char in chars if "read" in char.properties]
+
+        control = self._find_control(chars, control_uuid.lower())
+        if control is None:
+            raise ValueError("Device exposes no writable characteristic")
+        self.control: BleakGATTCharacteristic = control
+
+        response_handles = frozenset(char.handle for char in chars if char.uuid.lower() == response_uuid.lower())
+        if not response_handles:
+            logger.warning(f"No {response_uuid} characteristic, accepting responses from every notifier")
+            response_handles = frozenset(char.handle for char in self.notify)
+        self.response_handles: FrozenSet[int] = response_handles
+
+    @staticmethod
+    def _find_control(chars: List[BleakGATTCharacteristic], control_uuid: str) -> Optional[BleakGATTCharacteristic]:
+        writable = [char for char in chars if is_writable(char)]
+        for char in writable:
+            if char.uuid.lower() == control_uuid:
+                return char
+        # Fall back to the first vendor characteristic, then to anything writable
+        for char in writable:
+            if is_vendor(char):
+                logger.warning(f"No {control_uuid} characteristic, writing commands to {char.uuid}")
+                return char
+        return writable[0] if writable else None
+
+    def is_response(self, handle: int) -> bool:
+        return handle in self.response_handles
+
+    def __getitem__(self, handle: int) -> BleakGATTCharacteristic:
+        return self.by_handle[handle]
+
+    def __repr__(self):
+        return 'CharacteristicIndex(control={!r}, response_handles={!r}, notify={!r})'.format(
+            self.control.uuid, sorted(self.response_handles), [char.uuid for char in self.notify])
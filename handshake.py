@@ -0,0 +1,146 @@
+import asyncio
+import enum
+import time
+from typing import Awaitable, Callable, Dict, Optional, Union
+
+from bleak import BleakClient
+from bleak.backends.characteristic import BleakGATTCharacteristic
+
+import frames
+from classes import BytesLike
+from codes import codes
+from gatt import CharacteristicIndex
+from logger import logger
+from packetizer import Packetizer
+from profile_cache import DeviceProfile
+
+STEP_TIMEOUT = 5.0
+PACING = 0.1  # gap the light needs between handshake writes
+
+
+class Step(enum.Enum):
+    PAIR = "pair"
+    SUBSCRIBE = "subscribe"
+    HELLO = "hello"
+    QUERY = "query"
+    SYNC_TIME = "sync_time"
+    READ = "read"
+    DONE = "done"
+    FAILED = "failed"
+
+
+NEXT = {
+    Step.PAIR: Step.SUBSCRIBE,
+    Step.SUBSCRIBE: Step.HELLO,
+    Step.HELLO: Step.QUERY,
+    Step.QUERY: Step.SYNC_TIME,
+    Step.SYNC_TIME: Step.READ,
+    Step.READ: Step.DONE,
+}
+
+
+class HandshakeError(Exception):
+    def __init__(self, step: Step, cause: BaseException):
+        super().__init__(f"Handshake failed during {step.value}: {cause!r}")
+        self.step = step
+        self.cause = cause
+
+
+class Handshake:
+    """Brings a freshly connected light to the point where it accepts commands.
+
+    Runs PAIR -> SUBSCRIBE -> HELLO -> QUERY -> SYNC_TIME -> READ -> DONE, each
+    step under its own timeout. Steps a valid cached profile makes redundant
+    (pairing, the initial reads) are skipped, and all waiting is done with
+    `asyncio.sleep` so other connections and the GUI keep running.
+    """
+
+    def __init__(self, client: BleakClient, index: CharacteristicIndex,
+                 notification_handler: Callable[[int, bytearray], Union[None, Awaitable[None]]],
+                 profile: Optional[DeviceProfile] = None, pair: bool = True,
+                 step_timeout: float = STEP_TIMEOUT, pacing: float = PACING, concurrent_subscribe: bool = True):
+        self.client = client
+        self.index = index
+        self.notification_handler = notification_handler
+        self.profile = profile
+        self.pair = pair
+        self.step_timeout = step_timeout
+        self.pacing = pacing
+        self.concurrent_subscribe = concurrent_subscribe
+
+        self.state = Step.PAIR
+        self.pairing = profile.handshake.get("pairing", "skipped") if profile else "skipped"
+        self.durations: Dict[Step, float] = {}
+        self._steps: Dict[Step, Callable[[], Awaitable[None]]] = {
+            Step.PAIR: self._pair,
+            Step.SUBSCRIBE: self._subscribe,
+            Step.HELLO: self._hello,
+            Step.QUERY: self._query,
+            Step.SYNC_TIME: self._sync_time,
+            Step.READ: self._read,
+        }
+
+    async def run(self) -> None:
+        while self.state is not Step.DONE:
+            step = self.state
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(self._steps[step](), self.step_timeout)
+            except Exception as e:
+                self.state = Step.FAILED
+                raise HandshakeError(step, e) from e
+            self.durations[step] = time.monotonic() - started
+            self.state = NEXT[step]
+        logger.info("Handshake complete in {:.3f}s ({})".format(
+            sum(self.durations.values()),
+            ", ".join(f"{step.value} {duration:.3f}s" for step, duration in self.durations.items())))
+
+    async def _pair(self) -> None:
+        if not self.pair or self.profile is not None:
+            return
+        # Try to pair (on some OS's this will expectedly fail)
+        logger.info("Attempting to pair...")
+        try:
+            await self.client.pair()
+            self.pairing = "paired"
+        except NotImplementedError:
+            # This is expected on Mac
+            self.pairing = "unsupported"
+
+    async def _subscribe(self) -> None:
+        handles = self.profile.notify_handles if self.profile else [char.handle for char in self.index.notify]
+        chars = [self.index[handle] for handle in handles]
+        logger.info(f"Enabling notifications on {', '.join(char.uuid for char in chars)}")
+        if self.concurrent_subscribe:
+            results = await asyncio.gather(*(self._start_notify(char) for char in chars), return_exceptions=True)
+            # Some backends only allow one descriptor write at a time, retry those one by one
+            chars = [char for char, result in zip(chars, results) if isinstance(result, Exception)]
+        for char in chars:
+            await self._start_notify(char)
+            await asyncio.sleep(self.pacing)
+
+    async def _start_notify(self, char: BleakGATTCharacteristic) -> None:
+        await self.client.start_notify(char, self.notification_handler)  # type: ignore
+
+    async def _write(self, data: BytesLike) -> None:
+        # Anything longer than one write goes out as a header packet and continuations
+        for packet in Packetizer.for_client(self.client).packets(data):
+            await self.client.write_gatt_char(self.index.control, packet, response=True)
+        await asyncio.sleep(self.pacing)
+
+    async def _hello(self) -> None:
+        await self._write(codes["handshake"]["hello"])
+
+    async def _query(self) -> None:
+        await self._write(codes["handshake"]["query"])
+
+    async def _sync_time(self) -> None:
+        await self._write(frames.encode_datetime())
+
+    async def _read(self) -> None:
+        # A valid profile means this device was read on an earlier connect
+        if self.profile is not None:
+            return
+        for char in self.index.readable:
+            logger.info(f"Reading from {char.uuid}")
+            await self.client.read_gatt_char(char)
@@ -3,24 +3,90 @@
 
 # pylint: disable=wrong-import-position
 
+import atexit
 import logging
+import os
+import sys
+from binascii import hexlify
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+
+class _DeferredQueueHandler(QueueHandler):
+    # The stock prepare() formats the message on the calling thread; leave that to the listener
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class Hex:
+    """Log argument that hexlifies its bytes only if the record is actually emitted."""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes | bytearray | memoryview):
+        # Snapshot, the buffer may be reused before the listener thread gets to it
+        self.data = bytes(data)
+
+    def __str__(self):
+        return hexlify(self.data, ":").decode()
+
+    __repr__ = __str__
 
-from rich.logging import RichHandler
-from rich import traceback
 
 logger: logging.Logger = logging.getLogger("tutorial_logger")
-sh = RichHandler(rich_tracebacks=True, enable_link_path=True, show_time=False)
-stream_formatter = logging.Formatter("%(asctime)s.%(msecs)03d %(message)s", datefmt="%H:%M:%S")
+# rich takes longer to import than the rest of a short command, so only pay for it on a terminal
+RICH = sys.stderr.isatty()
+if RICH:
+    from rich.logging import RichHandler
+
+    sh: logging.Handler = RichHandler(rich_tracebacks=True, enable_link_path=True, show_time=False)
+    stream_formatter = logging.Formatter("%(asctime)s.%(msecs)03d %(message)s", datefmt="%H:%M:%S")
+else:
+    sh = logging.StreamHandler()
+    stream_formatter = logging.Formatter("%(asctime)s.%(msecs)03d %(levelname)s %(message)s", datefmt="%H:%M:%S")
 sh.setFormatter(stream_formatter)
 sh.setLevel(logging.DEBUG)
-logger.addHandler(sh)
+
+# Records are queued on the event loop and rendered by a background thread
+log_queue: SimpleQueue = SimpleQueue()
+qh = _DeferredQueueHandler(log_queue)
+listener = QueueListener(log_queue, sh, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
+
+logger.addHandler(qh)
 logger.setLevel(logging.INFO)
 
 bleak_logger = logging.getLogger("bleak")
 bleak_logger.setLevel(logging.WARNING)
-bleak_logger.addHandler(sh)
+bleak_logger.addHandler(qh)
+
+if RICH:
+    from rich import traceback
+
+    traceback.install()  # Enable exception tracebacks in rich logger
+
+
+def use_handlers(*handlers: logging.Handler) -> None:
+    """Replace where queued records end up, e.g. a TUI panel instead of the console."""
+    listener.handlers = handlers
+
+
+# Packet trace, one switchable logger per subsystem: rx (notifications), tx (writes), reassembly
+TRACE_SUBSYSTEMS = ("rx", "tx", "reassembly")
+
+
+def trace_logger(subsystem: str) -> logging.Logger:
+    return logger.getChild(f"trace.{subsystem}")
+
+
+def set_trace(subsystem: str, enabled: bool = True) -> None:
+    trace_logger(subsystem).setLevel(logging.DEBUG if enabled else logging.WARNING)
+
 
-traceback.install()  # Enable exception tracebacks in rich logger
+for _subsystem in TRACE_SUBSYSTEMS:
+    # Off unless listed in MZDS01_TRACE, e.g. MZDS01_TRACE=rx,tx
+    set_trace(_subsystem, _subsystem in os.environ.get("MZDS01_TRACE", "").split(","))
 
 GOPRO_BASE_UUID = "b5f9{}-aa8d-11e3-9046-0002a5d5c51b"
 GOPRO_BASE_URL = "http://10.5.5.9:8080"
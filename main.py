@@ -1,17 +1,19 @@
 import sys
+import logging
+import time
 import asyncio
-from asyncio import Event
-from time import sleep
-from datetime import datetime
-from binascii import hexlify
-from typing import Dict, Any, List, Callable, Optional
-from bleak import BleakScanner, BleakClient
-from bleak.backends.device import BLEDevice as BleakDevice
-
-from classes import Response
-from logger import logger
+from typing import Dict, Any, Callable, Optional, Tuple
+from bleak import BleakClient
+
+import frames
+from gatt import CharacteristicIndex
+from profile_cache import ProfileCache
+from scanner import Scanner, backoff
+from session import ClientFactory, Session, open_connection
+from logger import Hex, logger, trace_logger
+from metrics import metrics
 from codes import codes
-from codes import BLUETOOTH_ADDRESS, RESPONSE_UUID
+from codes import BLUETOOTH_ADDRESS
 
 def exception_handler(loop: asyncio.AbstractEventLoop, context: Dict[str, Any]) -> None:
     msg = context.get("exception", context["message"])
@@ -21,98 +23,29 @@ def exception_handler(loop: asyncio.AbstractEventLoop, context: Dict[str, Any])
 
 async def connect_ble(
     notification_handler: Callable[[int, bytes], None],
-) -> BleakClient:
+    profiles: Optional[ProfileCache] = None,
+    scanner: Optional[Scanner] = None,
+    address: str = BLUETOOTH_ADDRESS,
+    client_factory: ClientFactory = BleakClient,
+) -> Tuple[BleakClient, CharacteristicIndex]:
 
     asyncio.get_event_loop().set_exception_handler(exception_handler)
+    profiles = profiles or ProfileCache()
+    scanner = scanner or Scanner()
 
     RETRIES = 10
     for retry in range(RETRIES):
         try:
-            # Map of discovered devices indexed by name
-            devices: Dict[str, BleakDevice] = {}
-
-            # Scan for devices
-            logger.info("Scanning for bluetooth devices...")
-            def _scan_callback(device: BleakDevice, _: Any) -> None:
-                # Add to the dict if not unknown
-                if device.name and device.name != "Unknown":
-                    devices[device.name] = device
-
-            # Scan until we find devices
-            matched_devices: List[BleakDevice] = []
-            while len(matched_devices) == 0:
-                # Now get list of connectable advertisements
-                for device in await BleakScanner.discover(timeout=5, detection_callback=_scan_callback):
-                    device: BleakDevice = device
-                    if True:  # device.name != "Unknown" and device.name is not None:
-                        devices[device.address] = device
-                # Log every device we discovered
-                for d in devices:
-                    logger.info(f"\tDiscovered: {d}")
-                # Now look for our matching device
-                address = BLUETOOTH_ADDRESS
-                matched_devices = [device for name, device in devices.items() if name == address]
-                print(f"Found {len(matched_devices)} matching devices.")
-
-            # Connect to first matching Bluetooth device
-            device = matched_devices[0]
-
-            logger.info(f"Establishing BLE connection to {device}...")
-            client = BleakClient(device)
-            await client.connect(timeout=15)
-            logger.info("BLE Connected!")
-
-            # Try to pair (on some OS's this will expectedly fail)
-            logger.info("Attempting to pair...")
-            try:
-                await client.pair()
-            except NotImplementedError:
-                # This is expected on Mac
-                pass
-            logger.info("Pairing complete!")
-
-            # Enable notifications on all notifiable characteristics
-            logger.info("Enabling notifications, reading and writing...")
-            for service in client.services:
-                for char in service.characteristics:
-                    # logger.info(" ".join(char.properties))
-                    if "notify" in char.properties and char.uuid[0] != "0":
-                        logger.info(f"Enabling notification on char {char.uuid}")
-                        await client.start_notify(char, notification_handler)  # type: ignore
-                        # break
-                    sleep(0.1)
-                    if "write" in char.properties:
-                        logger.info(f"Writing to char {char.uuid}")
-                        await client.write_gatt_char(
-                            # "B02EAEAA-F6BC-4A7E-BC94-F7B7FC8DEDOB",
-                            char,
-                            bytearray([0xFE, 0x01, 0x00, 0x02, 0x50, 0x11]), response=True)
-                        sleep(0.1)
-                        await client.write_gatt_char(
-                            # "B02EAEAA-F6BC-4A7E-BC94-F7B7FC8DEDOB",
-                            char,
-                            bytearray([0xFE, 0x01, 0x00, 0x02, 0x30, 0x04]), response=True)
-
-                        today = datetime.now()
-                        datetime_now_str = today.strftime("%Y%m%d%H%M%S")
-                        # logger.info(f"today's datetime: {datetime_now_str}")
-                        datetime_now_bytes = datetime_now_str.encode()
-                        payload = bytearray([0xFE, 0x01, 0x00, 0x10, 0x50, 0x01])
-                        payload.extend(datetime_now_bytes)
-                        await client.write_gatt_char(
-                            # "B02EAEAA-F6BC-4A7E-BC94-F7B7FC8DEDOB",
-                            char, payload, response=True)
-
-                    if "read" in char.properties:
-                        logger.info(f"Reading from {char.uuid}")
-                        await client.read_gatt_char(char)
-            logger.info("Done enabling notifications")
-
-            for service in client.services:
-                for char in service.characteristics:
-                    if "read" in char.properties:
-                        logger.info(f"Reading from {char.uuid}")
-                        await client.read_gatt_char(char)
+            started = time.monotonic()
+            device = (await scanner.find([address])).get(address.upper())
+            if device is None:
+                raise Exception(f"{address} was not found")
+
+            with metrics.timer("connect", address):
+                client, index = await open_connection(device, notification_handler, profiles, client_factory)
+            connected = time.monotonic() - started
+            logger.info(f"Time to discover: {scanner.time_to_discover:.3f}s, "
+                        f"time to connect: {connected - scanner.time_to_discover:.3f}s")
 
             # enable write like iphone
             # logger.info("Going to send a 2nd packet")
@@ -121,83 +54,69 @@ async def connect_ble(
             #
             # logger.info("Finished sending a 2nd packet")
 
-            return client
+            return client, index
         except Exception as e:
             logger.error(f"Connection establishment failed: {e}")
-            logger.warning(f"Retrying #{retry}")
+            # The sighting may be what went stale, so look again next time
+            scanner.forget(address)
+            if retry < RETRIES - 1:
+                metrics.inc("connect_retries", address)
+                delay = backoff(retry)
+                logger.warning(f"Retrying #{retry} in {delay:.1f}s")
+                await asyncio.sleep(delay)
 
     raise Exception(f"Couldn't establish BLE connection after {RETRIES} retries")
 
 
-async def write_to_client(client: BleakClient, event: Event, data: bytes | bytearray | memoryview, comment: Optional[str]) -> None:
-    for service in client.services:
-        for char in service.characteristics:
-            if "write" in char.properties:
-                logger.info(f"Writing to char {char.uuid} ({comment})")
-                # event.clear()
-                await client.write_gatt_char(char, data, response=True)
-                # await event.wait()
+async def write_to_client(client: BleakClient, index: CharacteristicIndex, data: bytes | bytearray | memoryview,
+                          comment: Optional[str] = None, response: bool = True) -> None:
+    if comment:
+        logger.info("Writing to char %s (%s)", index.control.uuid, comment)
+    tx = trace_logger("tx")
+    if tx.isEnabledFor(logging.DEBUG):
+        tx.debug("Writing to %s (response=%s): %s", client.address, response, Hex(data))
+    await client.write_gatt_char(index.control, data, response=response)
 
 async def main() -> None:
 
-    event = asyncio.Event()
-
-
-    client: BleakClient
-    response = Response()
-
-    def notification_handler(handle: int, data: bytes) -> None:
-        logger.info(f'Received response at {handle=}: {hexlify(data, ":")!r}')
-
-        response.accumulate(data)
+    session = Session(BLUETOOTH_ADDRESS)
 
-        if response.is_received:
-            response.parse()
-
-            # If this is the correct handle and the status is success, the command was a success
-            if client.services.characteristics[handle].uuid == RESPONSE_UUID and response.status == 0:
+    async def send(data: bytes | bytearray | memoryview, comment: str) -> None:
+        logger.info(comment)
+        try:
+            response = await session.request(data)
+        except asyncio.TimeoutError:
+            logger.warning(f"No response to '{comment}'")
+        else:
+            if response.status == 0:
                 logger.info("Successfully received the response")
-            # Anything else is unexpected. This shouldn't happen
-            else:
-                logger.error("Unexpected response")
-
-            # Notify writer that procedure is complete
-            event.set()
-
 
     # find and connect to client
-    client = await connect_ble(notification_handler)
-
-
-    event.clear()
-    # await write_to_client(client, event, codes["colors"]["OFF"], "Turning Off")
-    await write_to_client(client, event, codes["colors"]["ON"], "Turning On Light")
-    sleep(2)
-    await write_to_client(client, event, codes["colors"]["WWHITE"], "Warm white")
-    sleep(2)
-    await write_to_client(client, event, codes["colors"]["DBLUE"], "Dark Blue")
-    sleep(2)
-    new_brightness = codes["brightness"]["custom"].copy()
-    new_brightness.extend([0x10])
-    await write_to_client(client, event, new_brightness, "Set brightness to 0x10")
-    sleep(2)
-    new_brightness = codes["brightness"]["custom"].copy()
-    new_brightness.extend([0x64])
-    await write_to_client(client, event, new_brightness, "Set brightness to 0x64")
-    sleep(2)
-    await write_to_client(client, event, codes["colors"]["GREEN"], "Green")
-    sleep(2)
-    await write_to_client(client, event, codes["colors"]["LBLUE"], "Light Blue")
-    sleep(2)
-    yellow = codes["colors"]["BASE"].copy()
-    yellow.extend([0xFF, 0xFF, 0x00, 0x00]) # rgb then trailing 0x00
-    await write_to_client(client, event, yellow, "Yellow")
-    sleep(2)
-    await write_to_client(client, event, codes["colors"]["OFF"], "Turning Off")
+    session.attach(*await connect_ble(session.handler))
+
+
+    # await send(codes["colors"]["OFF"], "Turning Off")
+    await send(codes["colors"]["ON"], "Turning On Light")
+    await asyncio.sleep(2)
+    await send(codes["colors"]["WWHITE"], "Warm white")
+    await asyncio.sleep(2)
+    await send(codes["colors"]["DBLUE"], "Dark Blue")
+    await asyncio.sleep(2)
+    await send(frames.encode_brightness(0x10), "Set brightness to 0x10")
+    await asyncio.sleep(2)
+    await send(frames.encode_brightness(0x64), "Set brightness to 0x64")
+    await asyncio.sleep(2)
+    await send(codes["colors"]["GREEN"], "Green")
+    await asyncio.sleep(2)
+    await send(codes["colors"]["LBLUE"], "Light Blue")
+    await asyncio.sleep(2)
+    await send(frames.encode_color(0xFF, 0xFF, 0x00), "Yellow")
+    await asyncio.sleep(2)
+    await send(codes["colors"]["OFF"], "Turning Off")
 
     logger.info("Disconnecting...")
 
-    await client.disconnect()
+    await session.disconnect()
     logger.info("Disconnected")
 
 
@@ -0,0 +1,173 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from logger import logger
+
+SUB_BITS = 4  # 16 linear sub-buckets per power of two, so any bucket is within 6.25% of its values
+SUB_BUCKETS = 1 << SUB_BITS
+MAX_OCTAVE = 28  # anything from 31 << 28 us (~2.3 hours) up lands in the last bucket
+BUCKETS = (MAX_OCTAVE + 2) * SUB_BUCKETS
+QUANTILES = (0.5, 0.9, 0.99)
+PREFIX = "mzds01"
+
+Key = Tuple[str, Optional[str]]
+
+
+def _bucket(micros: int) -> int:
+    if micros < 2 * SUB_BUCKETS:
+        return micros
+    octave = micros.bit_length() - (SUB_BITS + 1)
+    return min(octave * SUB_BUCKETS + (micros >> octave), BUCKETS - 1)
+
+
+def _bounds(index: int) -> Tuple[int, int]:
+    if index < 2 * SUB_BUCKETS:
+        return index, index + 1
+    octave = index // SUB_BUCKETS - 1
+    mantissa = index - octave * SUB_BUCKETS
+    return mantissa << octave, (mantissa + 1) << octave
+
+
+class Histogram:
+    """Log-linear latency histogram in a fixed number of integer buckets, in microseconds.
+
+    Memory stays the same however many samples it sees, and every
+    quantile is exact to within a bucket (6.25%).
+    """
+
+    def __init__(self):
+        self.buckets: List[int] = [0] * BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.buckets[_bucket(int(seconds * 1_000_000))] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        # Midpoint of the bucket holding the q-th sample, in seconds
+        if not self.count:
+            return 0.0
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                low, high = _bounds(index)
+                return min((low + high) / 2 / 1_000_000, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def __repr__(self):
+        return 'Histogram(count={!r}, p50={:.6f}s, p99={:.6f}s, max={:.6f}s)'.format(
+            self.count, self.quantile(0.5), self.quantile(0.99), self.max)
+
+
+class Registry:
+    """Latency histograms and event counters, each per operation and optionally per device."""
+
+    def __init__(self):
+        self.histograms: Dict[Key, Histogram] = {}
+        self.counters: Dict[Key, int] = {}
+
+    def histogram(self, name: str, device: Optional[str] = None) -> Histogram:
+        histogram = self.histograms.get((name, device))
+        if histogram is None:
+            histogram = self.histograms[(name, device)] = Histogram()
+        return histogram
+
+    def observe(self, name: str, seconds: float, device: Optional[str] = None) -> None:
+        self.histogram(name, device).record(seconds)
+
+    @contextmanager
+    def timer(self, name: str, device: Optional[str] = None) -> Iterator[None]:
+        # Times the block whether it returns or raises; works around awaits too
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, device)
+
+    def inc(self, name: str, device: Optional[str] = None, amount: int = 1) -> None:
+        self.counters[(name, device)] = self.counters.get((name, device), 0) + amount
+
+    def counter(self, name: str, device: Optional[str] = None) -> int:
+        return self.counters.get((name, device), 0)
+
+    def summary(self) -> Dict[Key, Dict[str, float]]:
+        return {key: {"count": h.count, "mean": h.mean, "max": h.max,
+                      **{f"p{round(q * 100)}": h.quantile(q) for q in QUANTILES}}
+                for key, h in self.histograms.items()}
+
+    def reset(self) -> None:
+        self.histograms.clear()
+        self.counters.clear()
+
+    def to_prometheus(self) -> str:
+        """Prometheus text format: histograms as summaries in seconds, counters as *_total."""
+        lines = []
+        for name in sorted({name for name, _ in self.histograms}):
+            metric = f"{PREFIX}_{name}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for (key, device), histogram in sorted(self.histograms.items(), key=lambda item: str(item[0])):
+                if key != name:
+                    continue
+                for q in QUANTILES:
+                    lines.append(f"{metric}{_labels(device, quantile=q)} {histogram.quantile(q):.6f}")
+                lines.append(f"{metric}_sum{_labels(device)} {histogram.sum:.6f}")
+                lines.append(f"{metric}_count{_labels(device)} {histogram.count}")
+        for name in sorted({name for name, _ in self.counters}):
+            metric = f"{PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (key, device), value in sorted(self.counters.items(), key=lambda item: str(item[0])):
+                if key == name:
+                    lines.append(f"{metric}{_labels(device)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        # Atomic replace, for node_exporter's textfile collector
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, path)
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9464) -> asyncio.AbstractServer:
+        """Answers every HTTP request with the current metrics; stop it with `close()` on the server."""
+        async def respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            try:
+                await reader.readuntil(b"\r\n\r\n")
+                body = self.to_prometheus().encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                             b"Content-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+                await writer.drain()
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(respond, host, port)
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return server
+
+    def __repr__(self):
+        return 'Registry(histograms={!r}, counters={!r})'.format(len(self.histograms), len(self.counters))
+
+
+def _labels(device: Optional[str], **extra) -> str:
+    labels = [f'device="{device}"'] if device is not None else []
+    labels += [f'{name}="{value}"' for name, value in extra.items()]
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+# Shared by everything in the process, like `logger`
+metrics = Registry()
@@ -1,23 +1,14 @@
-from binascii import hexlify
+import logging
 
-from logger import logger
-from codes import RESPONSE_UUID
+from logger import Hex, trace_logger
+from channel import CommandChannel
 
+rx = trace_logger("rx")
 
-def notification_handler(response, client, event, handle: int, data: bytes) -> None:
-    logger.info(f'Received response at {handle=}: {hexlify(data, ":")!r}')
 
-    response.accumulate(data)
+def notification_handler(channel: CommandChannel, handle: int, data: bytes) -> None:
+    if rx.isEnabledFor(logging.DEBUG):
+        rx.debug("Received response at handle=%d: %s", handle, Hex(data))
 
-    if response.is_received:
-        response.parse()
-
-        # If this is the correct handle and the status is success, the command was a success
-        if client.services.characteristics[handle].uuid == RESPONSE_UUID and response.status == 0:
-            logger.info("Successfully received the response")
-        # Anything else is unexpected. This shouldn't happen
-        else:
-            logger.error("Unexpected response")
-
-        # Notify writer that procedure is complete
-        event.set()
\ No newline at end of file
+    # Reassemble and hand the response to whichever command is waiting on its id
+    channel.notify(handle, data)
@@ -0,0 +1,47 @@
+from typing import Callable, List, Set
+
+_MISSING = object()
+
+
+class Field:
+    """An attribute of an `Observable` that reports when it is assigned a different value."""
+
+    def __set_name__(self, owner, name: str):
+        self.name = name
+        self.slot = '_' + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return obj.__dict__.get(self.slot)
+
+    def __set__(self, obj, value):
+        # Re-assigning an equal value is not a change, so polling the same reading costs no redraw
+        if obj.__dict__.get(self.slot, _MISSING) == value:
+            return
+        obj.__dict__[self.slot] = value
+        obj.changed(self.name)
+
+
+class Observable:
+    """Collects the names of `Field`s that changed since the last `take_dirty`."""
+
+    def __init__(self):
+        self._dirty: Set[str] = set()
+        self._listeners: List[Callable[[str], None]] = []
+
+    def changed(self, name: str) -> None:
+        self._dirty.add(name)
+        for listener in self._listeners:
+            listener(name)
+
+    def subscribe(self, listener: Callable[[str], None]) -> None:
+        self._listeners.append(listener)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._dirty)
+
+    def take_dirty(self) -> Set[str]:
+        dirty, self._dirty = self._dirty, set()
+        return dirty
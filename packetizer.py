@@ -0,0 +1,108 @@
+from typing import Iterable, List
+
+from classes import BytesLike, CONT_MASK, HDR_EXT_13, HDR_EXT_16, HDR_GENERAL
+from logger import logger
+
+DEFAULT_MTU = 23
+ATT_HEADER = 3  # opcode and handle in front of every write and notification
+# What each packet costs on air besides its ATT payload: preamble, access address, link layer header
+# and CRC (1 + 4 + 2 + 3), the L2CAP header (4) and the ATT header
+PACKET_OVERHEAD = 10 + 4 + ATT_HEADER
+
+GENERAL_MAX = 0x1F
+EXT_13_MAX = 0x1FFF
+EXT_16_MAX = 0xFFFF
+
+
+def header(length: int) -> bytes:
+    # The smallest header that can carry the length, as Response.accumulate decodes it
+    if length <= GENERAL_MAX:
+        return bytes([HDR_GENERAL | length])
+    if length <= EXT_13_MAX:
+        return bytes([HDR_EXT_13 | length >> 8, length & 0xFF])
+    if length <= EXT_16_MAX:
+        return bytes([HDR_EXT_16, length >> 8, length & 0xFF])
+    raise ValueError(f"{length} bytes is more than one message can carry")
+
+
+def fragment(message: BytesLike, size: int) -> List[bytes]:
+    """Splits a message into packets of at most `size` bytes: a header first, then continuations."""
+    view = memoryview(message)
+    length = len(view)
+    head = header(length)
+    if size <= len(head) or size < 2:
+        raise ValueError(f"{size} byte packets are too small for a {length} byte message")
+    first = size - len(head)
+    packets = [head + view[:first]]
+    continuation = bytes([CONT_MASK])
+    for i in range(first, length, size - 1):
+        packets.append(continuation + view[i:i + size - 1])
+    return packets
+
+
+async def acquire_mtu(client) -> int:
+    """Makes sure a freshly connected client knows the connection's MTU, and returns it.
+
+    BlueZ doesn't report the MTU on connect; bleak has to ask for it first,
+    through a private call on its backend, so it is only made where it exists.
+    """
+    acquire = getattr(getattr(client, "_backend", None), "_acquire_mtu", None)
+    if acquire is not None:
+        try:
+            await acquire()
+        except Exception as e:
+            logger.warning(f"Could not acquire the MTU of {client.address}, assuming {DEFAULT_MTU}: {e!r}")
+            return DEFAULT_MTU
+    mtu = getattr(client, "mtu_size", None) or DEFAULT_MTU
+    logger.info(f"Using MTU {mtu} with {client.address} ({mtu - ATT_HEADER} bytes per write)")
+    return mtu
+
+
+def bytes_on_air(packets: Iterable[BytesLike]) -> int:
+    return sum(len(packet) + PACKET_OVERHEAD for packet in packets)
+
+
+class Packetizer:
+    """Cuts outgoing data into writes that fit the connection's MTU.
+
+    Command frames that fit in one write go out as they are. Anything longer
+    (datetime sync at small MTUs, bulk uploads) is sent as a header packet and
+    continuations in the same format the light uses for its responses, so
+    `Response.accumulate` reassembles it. `pack` joins small frames into as few
+    writes as possible, for lights that accept more than one frame per write.
+    """
+
+    def __init__(self, mtu: int = DEFAULT_MTU):
+        self.mtu = mtu
+        self.payload_size = mtu - ATT_HEADER
+
+    @classmethod
+    def for_client(cls, client) -> "Packetizer":
+        # bleak reports the negotiated MTU once it is known (see acquire_mtu); until then it is the default
+        return cls(getattr(client, "mtu_size", None) or DEFAULT_MTU)
+
+    def packets(self, data: BytesLike) -> List[BytesLike]:
+        if len(data) <= self.payload_size:
+            return [data]
+        return fragment(data, self.payload_size)
+
+    def pack(self, frames: Iterable[BytesLike]) -> List[bytes]:
+        # Frames carry their own length, so back to back they still split apart on the other end
+        writes: List[bytes] = []
+        pending: List[BytesLike] = []
+        filled = 0
+        for frame in frames:
+            if filled + len(frame) > self.payload_size and pending:
+                writes.append(b"".join(pending))
+                pending, filled = [], 0
+            if len(frame) > self.payload_size:
+                writes.extend(bytes(packet) for packet in fragment(frame, self.payload_size))
+                continue
+            pending.append(frame)
+            filled += len(frame)
+        if pending:
+            writes.append(b"".join(pending))
+        return writes
+
+    def __repr__(self):
+        return 'Packetizer(mtu={!r})'.format(self.mtu)
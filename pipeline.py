@@ -0,0 +1,99 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Optional, Tuple
+
+import frames
+from classes import BytesLike
+from logger import logger
+
+DEFAULT_WINDOW = 4
+RATE_SAMPLES = 64
+
+# Color and brightness frames are idempotent and superseded by the next one, so losing one
+# costs nothing; power, timer and datetime sync change state and must be acknowledged.
+LATEST_WINS = frozenset({frames.OP_COLOR, frames.OP_BRIGHTNESS})
+
+
+def needs_ack(data: BytesLike) -> bool:
+    return frames.opcode(data) not in LATEST_WINS
+
+
+class CommandQueue:
+    """Per-connection send queue with up to `window` writes in flight at once.
+
+    Latest-wins frames go out as write-without-response, everything else as an
+    acknowledged write. Frames are copied on `put`, so callers may pass the
+    reused views handed out by the `frames` encoders.
+
+    Frames are taken off the queue in order, but with a window above 1 their
+    writes overlap and may reach the light in a different order. Callers that
+    need one frame to land before another await the first before putting the
+    second, or use a window of 1.
+    """
+
+    def __init__(self, write: Callable[[BytesLike, bool], Awaitable[None]], window: int = DEFAULT_WINDOW) -> None:
+        self._write = write
+        self.window = window
+        self._queue: asyncio.Queue[Tuple[bytes, bool, asyncio.Future]] = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._completed: Deque[float] = deque(maxlen=RATE_SAMPLES)
+        self.sent = 0
+        self.failed = 0
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def commands_per_second(self) -> float:
+        # Achieved rate over the most recent completions
+        if len(self._completed) < 2:
+            return 0.0
+        elapsed = self._completed[-1] - self._completed[0]
+        return (len(self._completed) - 1) / elapsed if elapsed > 0 else 0.0
+
+    def put(self, data: BytesLike, response: Optional[bool] = None) -> asyncio.Future:
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.window)]
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((bytes(data), needs_ack(data) if response is None else response, future))
+        return future
+
+    async def send(self, data: BytesLike, response: Optional[bool] = None) -> None:
+        await self.put(data, response)
+
+    async def _worker(self) -> None:
+        while True:
+            data, response, future = await self._queue.get()
+            try:
+                await self._write(data, response)
+            except asyncio.CancelledError:
+                # Closed mid-write: whoever waits on this frame must not wait forever
+                future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.sent += 1
+                self._completed.append(time.monotonic())
+                if not future.done():
+                    future.set_result(None)
+            finally:
+                self._queue.task_done()
+
+    async def join(self) -> None:
+        await self._queue.join()
+
+    async def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        while not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            future.cancel()
+        logger.info(f"Command queue closed: {self.sent} sent, {self.failed} failed, "
+                    f"{self.commands_per_second:.1f} commands/s")
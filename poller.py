@@ -0,0 +1,52 @@
+import asyncio
+import time
+from typing import Optional
+
+MIN_POLL_INTERVAL = 1.0
+MAX_POLL_INTERVAL = 30.0
+POLL_BACKOFF = 2.0
+
+
+class AdaptivePoller:
+    """Fallback polling schedule for state the device also announces by notification.
+
+    Every poll that finds nothing new doubles the interval up to
+    `max_interval`; any activity (a change seen by a poll, or a notification)
+    drops it back to `min_interval`. `wake` cuts the current wait short.
+    """
+
+    def __init__(self, min_interval: float = MIN_POLL_INTERVAL, max_interval: float = MAX_POLL_INTERVAL,
+                 factor: float = POLL_BACKOFF):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.interval = min_interval
+        self.polls = 0
+        self.last_activity: Optional[float] = None
+        self._woken = asyncio.Event()
+
+    @property
+    def rate(self) -> float:
+        # Effective polls per second at the current interval
+        return 1 / self.interval
+
+    def activity(self) -> None:
+        self.interval = self.min_interval
+        self.last_activity = time.monotonic()
+
+    def idle(self) -> None:
+        self.interval = min(self.interval * self.factor, self.max_interval)
+
+    def wake(self) -> None:
+        self._woken.set()
+
+    async def wait(self) -> None:
+        try:
+            await asyncio.wait_for(self._woken.wait(), self.interval)
+        except asyncio.TimeoutError:
+            pass
+        self._woken.clear()
+        self.polls += 1
+
+    def __repr__(self):
+        return 'AdaptivePoller(interval={:.1f}s, polls={!r})'.format(self.interval, self.polls)
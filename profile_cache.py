@@ -0,0 +1,120 @@
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from bleak.backends.service import BleakGATTServiceCollection
+
+from gatt import CharacteristicIndex
+from logger import logger
+
+PROFILE_VERSION = 1
+CACHE_DIR_ENV = "MZDS01_CACHE_DIR"
+
+
+def default_directory() -> str:
+    # Read on every use so the environment can change after import
+    return os.environ.get(CACHE_DIR_ENV, os.path.join(os.path.expanduser("~"), ".cache", "mzds01", "profiles"))
+
+
+class DeviceProfile:
+    """What a connect learned about one device, so the next connect can skip relearning it."""
+
+    def __init__(self, address: str, characteristics: List[Tuple[int, str, List[str]]], control_handle: int,
+                 response_handles: List[int], notify_handles: List[int], handshake: Dict[str, Any]):
+        self.address = address
+        self.characteristics = characteristics
+        self.control_handle = control_handle
+        self.response_handles = response_handles
+        self.notify_handles = notify_handles
+        self.handshake = handshake
+
+    @classmethod
+    def from_index(cls, address: str, index: CharacteristicIndex, **handshake) -> 'DeviceProfile':
+        return cls(address,
+                   [(char.handle, char.uuid.lower(), list(char.properties)) for char in index.by_handle.values()],
+                   index.control.handle,
+                   sorted(index.response_handles),
+                   [char.handle for char in index.notify],
+                   handshake)
+
+    def matches(self, services: BleakGATTServiceCollection) -> bool:
+        # Only compares the table the backend already has in memory, no radio traffic
+        current = {handle: char.uuid.lower() for handle, char in services.characteristics.items()}
+        return current == {handle: uuid for handle, uuid, _ in self.characteristics}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": PROFILE_VERSION,
+            "address": self.address,
+            "characteristics": self.characteristics,
+            "control_handle": self.control_handle,
+            "response_handles": self.response_handles,
+            "notify_handles": self.notify_handles,
+            "handshake": self.handshake,
+        }
+
+    @classmethod
+    def from_dict(cls, value: Dict[str, Any]) -> 'DeviceProfile':
+        return cls(value["address"],
+                   [(handle, uuid, properties) for handle, uuid, properties in value["characteristics"]],
+                   value["control_handle"],
+                   value["response_handles"],
+                   value["notify_handles"],
+                   value["handshake"])
+
+    def __repr__(self):
+        return 'DeviceProfile(address={!r}, control_handle={!r}, response_handles={!r}, handshake={!r})'.format(
+            self.address, self.control_handle, self.response_handles, self.handshake)
+
+
+class ProfileCache:
+    """Device profiles on disk, one JSON file per light.
+
+    A matching profile lets a reconnect skip pairing, the characteristic reads
+    and the handshake steps already done. GATT service discovery itself still
+    runs: bleak performs it inside `connect()` and has no way to be handed a
+    table from here.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or default_directory()
+
+    def path(self, address: str) -> str:
+        return os.path.join(self.directory, address.replace(":", "-").upper() + ".json")
+
+    def load(self, address: str) -> Optional[DeviceProfile]:
+        try:
+            with open(self.path(address)) as f:
+                value = json.load(f)
+            if value.get("version") != PROFILE_VERSION or value.get("address", "").upper() != address.upper():
+                return None
+            return DeviceProfile.from_dict(value)
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable profile for {address}: {e}")
+            return None
+
+    def save(self, profile: DeviceProfile) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(profile.address)
+        # Write then rename so a crash mid-write never leaves a truncated profile behind
+        with open(path + ".tmp", "w") as f:
+            json.dump(profile.to_dict(), f)
+        os.replace(path + ".tmp", path)
+
+    def invalidate(self, address: str) -> None:
+        try:
+            os.remove(self.path(address))
+        except FileNotFoundError:
+            pass
+
+    def validate(self, address: str, services: BleakGATTServiceCollection) -> Optional[DeviceProfile]:
+        profile = self.load(address)
+        if profile is None:
+            return None
+        if not profile.matches(services):
+            logger.info(f"Cached profile for {address} no longer matches the device, relearning it")
+            self.invalidate(address)
+            return None
+        return profile
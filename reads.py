@@ -0,0 +1,75 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from logger import logger
+
+READ_TTL = 0.5  # values younger than this are served without touching the radio
+
+
+class ReadCache:
+    """Characteristic reads with a short-lived cache and single-flight deduplication.
+
+    Concurrent reads of the same characteristic share one GATT read, values
+    younger than `ttl` come from the cache, and `invalidate` (called when a
+    notification says a value changed, or after a write) forces the next read
+    to go to the device.
+    """
+
+    def __init__(self, read: Callable[[Hashable], Awaitable[bytearray]], ttl: float = READ_TTL):
+        self._read = read
+        self.ttl = ttl
+        self._values: Dict[Hashable, Tuple[bytearray, float]] = {}
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.reads = 0
+        self.hits = 0
+        self.shared = 0
+
+    async def read(self, char: Hashable, max_age: Optional[float] = None) -> bytearray:
+        max_age = self.ttl if max_age is None else max_age
+        cached = self._values.get(char)
+        if cached is not None and time.monotonic() - cached[1] <= max_age:
+            self.hits += 1
+            return cached[0]
+
+        future = self._in_flight.get(char)
+        if future is not None:
+            self.shared += 1
+            # shield so one waiter being cancelled doesn't cancel the read for everyone else
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(self._fetch(char))
+        self._in_flight[char] = future
+        return await asyncio.shield(future)
+
+    async def read_many(self, chars: Iterable[Hashable], max_age: Optional[float] = None) -> List[bytearray]:
+        return await asyncio.gather(*(self.read(char, max_age) for char in chars))
+
+    def invalidate(self, *chars: Hashable) -> None:
+        # No characteristics means everything, e.g. after a reconnect
+        if not chars:
+            chars = set(self._values) | set(self._in_flight)
+        for char in chars:
+            self._values.pop(char, None)
+            # A read already on the air may return the old value, let the next caller start a fresh one
+            self._in_flight.pop(char, None)
+
+    async def _fetch(self, char: Hashable) -> bytearray:
+        task = asyncio.current_task()
+        started = time.monotonic()
+        try:
+            value = await self._read(char)
+        finally:
+            current = self._in_flight.get(char) is task
+            if current:
+                del self._in_flight[char]
+        self.reads += 1
+        if current:
+            # Stamped with the start time, the value is only known to be good from then
+            self._values[char] = (value, started)
+        logger.debug(f"Read {char} in {(time.monotonic() - started) * 1000:.1f}ms")
+        return value
+
+    def __repr__(self):
+        return 'ReadCache(ttl={!r}, reads={!r}, hits={!r}, shared={!r})'.format(
+            self.ttl, self.reads, self.hits, self.shared)
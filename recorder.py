@@ -0,0 +1,283 @@
+import asyncio
+import enum
+import mmap
+import os
+import struct
+import time
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, Iterator, List, Optional, Union
+
+from classes import BytesLike, Response
+from logger import logger
+
+if TYPE_CHECKING:
+    from bleak import BleakClient
+
+# File layout, all little endian:
+#   header   MAGIC, version u16
+#   record   tag u8, direction u8, handle u16, timestamp f64, length u32, then `length` payload bytes
+# An INDEX record's payload is the previous index's offset (u64, 0 for none) followed by the
+# offsets of the events written since it; the TRAILER written on close points at the last index.
+# A file cut short by a crash has no trailer and is read with a linear scan instead.
+MAGIC = b"MZDSREC"
+VERSION = 1
+HEADER = struct.Struct("<7sH")
+RECORD = struct.Struct("<BBHdI")
+OFFSET = struct.Struct("<Q")
+INDEX_INTERVAL = 256  # events per index block
+
+
+class Tag(enum.IntEnum):
+    EVENT = 0x01
+    INDEX = 0x02
+    TRAILER = 0x03
+
+
+class Direction(enum.IntEnum):
+    WRITE = 0
+    READ = 1
+    NOTIFY = 2
+
+
+class Event:
+    def __init__(self, direction: Direction, handle: int, timestamp: float, payload: memoryview):
+        self.direction = direction
+        self.handle = handle
+        self.timestamp = timestamp
+        # A view into the mapped file, valid until the reader is closed
+        self.payload = payload
+
+    def __repr__(self):
+        return 'Event(direction={}, handle={!r}, timestamp={:.6f}, payload={})'.format(
+            self.direction.name, self.handle, self.timestamp, self.payload.hex(":"))
+
+
+class Recorder:
+    """Appends every write, read and notification of a session to a binary capture file."""
+
+    def __init__(self, path: str, index_interval: int = INDEX_INTERVAL):
+        self.path = path
+        self.index_interval = index_interval
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION))
+        self._started = time.monotonic()
+        self._pending: List[int] = []
+        self._last_index = 0
+        self.events = 0
+
+    def record(self, direction: Direction, handle: int, data: BytesLike) -> None:
+        self._pending.append(self._file.tell())
+        self._file.write(RECORD.pack(Tag.EVENT, direction, handle, time.monotonic() - self._started, len(data)))
+        self._file.write(data)
+        self.events += 1
+        if len(self._pending) >= self.index_interval:
+            self._write_index()
+
+    def _write_index(self) -> None:
+        offsets = [self._last_index] + self._pending
+        self._last_index = self._file.tell()
+        self._file.write(RECORD.pack(Tag.INDEX, 0, 0, time.monotonic() - self._started, OFFSET.size * len(offsets)))
+        self._file.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        self._pending = []
+        # An index is a checkpoint: everything before it is on disk
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        if self._pending:
+            self._write_index()
+        self._file.write(RECORD.pack(Tag.TRAILER, 0, 0, time.monotonic() - self._started, OFFSET.size))
+        self._file.write(OFFSET.pack(self._last_index))
+        self._file.close()
+        logger.info(f"Recorded {self.events} events to {self.path}")
+
+    def wrap(self, client: "BleakClient") -> "RecordingClient":
+        return RecordingClient(client, self)
+
+    def __enter__(self) -> "Recorder":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __repr__(self):
+        return 'Recorder(path={!r}, events={!r})'.format(self.path, self.events)
+
+
+class RecordingClient:
+    """Stands in for a BleakClient and records its GATT traffic; everything else passes through.
+
+    Use it as a session's client factory, e.g.
+    `Session(address, client_factory=lambda *a, **kw: recorder.wrap(BleakClient(*a, **kw)))`.
+    """
+
+    def __init__(self, client: "BleakClient", recorder: Recorder):
+        self._client = client
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _handle(self, char) -> int:
+        if isinstance(char, int):
+            return char
+        handle = getattr(char, "handle", None)
+        if handle is None:
+            resolved = self._client.services.get_characteristic(char)
+            handle = resolved.handle if resolved is not None else 0
+        return handle
+
+    async def write_gatt_char(self, char, data: BytesLike, response: bool = False) -> None:
+        self._recorder.record(Direction.WRITE, self._handle(char), data)
+        await self._client.write_gatt_char(char, data, response=response)
+
+    async def read_gatt_char(self, char, **kwargs) -> bytearray:
+        value = await self._client.read_gatt_char(char, **kwargs)
+        self._recorder.record(Direction.READ, self._handle(char), value)
+        return value
+
+    async def start_notify(self, char, callback: Callable, **kwargs) -> None:
+        handle = self._handle(char)
+
+        def recording(sender, data: bytearray):
+            self._recorder.record(Direction.NOTIFY, handle, data)
+            return callback(sender, data)
+
+        await self._client.start_notify(char, recording, **kwargs)
+
+
+class Capture:
+    """Random access to a capture file through `mmap`; events are views, nothing is copied."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None
+        try:
+            if os.fstat(self._file.fileno()).st_size < HEADER.size:
+                raise ValueError(f"{path} is not a version {VERSION} capture")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._map)
+            magic, version = HEADER.unpack_from(self._view)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} capture")
+            self.offsets = self._from_indexes()
+            if self.offsets is None:
+                logger.warning(f"{path} has no trailer, scanning it")
+                self.offsets = self._scan()
+        except BaseException:
+            self.close()
+            raise
+
+    def _from_indexes(self) -> Optional[List[int]]:
+        # Anything that doesn't look exactly like a trailer and a chain of indexes inside the file means a torn
+        # file, whose last bytes may happen to resemble a trailer; it is scanned instead
+        end = len(self._view)
+        trailer = end - RECORD.size - OFFSET.size
+        if trailer < HEADER.size:
+            return None
+        tag, _, _, _, length = RECORD.unpack_from(self._view, trailer)
+        if tag != Tag.TRAILER or length != OFFSET.size:
+            return None
+        (index,) = OFFSET.unpack_from(self._view, trailer + RECORD.size)
+        if not index and trailer != HEADER.size:
+            # Only a capture with no events at all closes without an index
+            return None
+        blocks = []
+        # Walk the chain of index blocks back to front
+        while index:
+            if not HEADER.size <= index <= trailer - RECORD.size:
+                return None
+            tag, _, _, _, length = RECORD.unpack_from(self._view, index)
+            if tag != Tag.INDEX or length < OFFSET.size or length % OFFSET.size or index + RECORD.size + length > trailer:
+                return None
+            offsets = struct.unpack_from(f"<{length // OFFSET.size}Q", self._view, index + RECORD.size)
+            # Indexes only point backwards, at the previous index and at the events written before them
+            if any(not HEADER.size <= offset < index for offset in offsets[1:]) or offsets[0] >= index:
+                return None
+            blocks.append(offsets[1:])
+            index = offsets[0]
+        return [offset for block in reversed(blocks) for offset in block]
+
+    def _scan(self) -> List[int]:
+        offsets = []
+        pos = HEADER.size
+        end = len(self._view)
+        while pos + RECORD.size <= end:
+            tag, _, _, _, length = RECORD.unpack_from(self._view, pos)
+            if pos + RECORD.size + length > end:
+                break  # torn final record
+            if tag == Tag.EVENT:
+                offsets.append(pos)
+            pos += RECORD.size + length
+        return offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, i: int) -> Event:
+        offset = self.offsets[i]
+        _, direction, handle, timestamp, length = RECORD.unpack_from(self._view, offset)
+        start = offset + RECORD.size
+        return Event(Direction(direction), handle, timestamp, self._view[start:start + length])
+
+    def __iter__(self) -> Iterator[Event]:
+        for i in range(len(self.offsets)):
+            yield self[i]
+
+    def responses(self) -> Iterator[Response]:
+        # Reassembles the notifications exactly as the command channel does, one reassembler per handle
+        reassemblers: Dict[int, Response] = {}
+        for event in self:
+            if event.direction is not Direction.NOTIFY:
+                continue
+            response = reassemblers.setdefault(event.handle, Response())
+            response.accumulate(event.payload)
+            if response.is_received:
+                response.parse()
+                yield response
+
+    def close(self) -> None:
+        if self._view is not None:
+            self._view.release()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Events still hold views into the mapping; it is unmapped once the last of them is gone
+                pass
+        self._file.close()
+
+    def __enter__(self) -> "Capture":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __repr__(self):
+        return 'Capture(path={!r}, events={!r})'.format(self.path, len(self.offsets))
+
+
+async def replay(capture: Capture, notify: Callable[[int, bytearray], Union[None, Awaitable[None]]],
+                 write: Optional[Callable[[int, bytearray], Union[None, Awaitable[None]]]] = None,
+                 speed: Optional[float] = 1.0) -> None:
+    """Feeds recorded notifications (and optionally writes) back through live callbacks.
+
+    `speed` scales the original timing, None replays as fast as possible.
+    Pass a session's `handler` to drive the channel's reassembly and parsing,
+    or a controller's `notify_callback()`.
+    """
+    started = time.monotonic()
+    for event in capture:
+        callback = notify if event.direction is Direction.NOTIFY else write
+        if callback is None or event.direction is Direction.READ:
+            continue
+        if speed is not None:
+            delay = started + event.timestamp / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        # Callbacks get a bytearray like bleak hands out, not a view into the file
+        result = callback(event.handle, bytearray(event.payload))
+        if asyncio.iscoroutine(result):
+            await result
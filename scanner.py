@@ -0,0 +1,88 @@
+import asyncio
+import random
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from bleak import BleakScanner
+from bleak.backends.device import BLEDevice as BleakDevice
+
+from logger import logger
+
+SCAN_TIMEOUT = 5.0
+MAX_AGE = 30.0  # a sighting this recent is trusted enough to connect without scanning
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 10.0
+
+
+def backoff(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    # Exponential backoff with full jitter, so many lights retrying don't retry in lockstep
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class Sighting:
+    def __init__(self, device: BleakDevice, rssi: Optional[int], last_seen: float):
+        self.device = device
+        self.rssi = rssi
+        self.last_seen = last_seen
+
+    def __repr__(self):
+        return 'Sighting(address={!r}, rssi={!r}, age={:.1f}s)'.format(
+            self.device.address, self.rssi, time.monotonic() - self.last_seen)
+
+
+class Scanner:
+    """Scans only until every wanted address has advertised, remembering what it saw."""
+
+    def __init__(self, max_age: float = MAX_AGE):
+        self.max_age = max_age
+        self.sightings: Dict[str, Sighting] = {}
+        self.time_to_discover: Optional[float] = None
+
+    def seen(self, address: str, max_age: Optional[float] = None) -> Optional[BleakDevice]:
+        sighting = self.sightings.get(address.upper())
+        max_age = self.max_age if max_age is None else max_age
+        if sighting is None or time.monotonic() - sighting.last_seen > max_age:
+            return None
+        return sighting.device
+
+    def forget(self, address: str) -> None:
+        self.sightings.pop(address.upper(), None)
+
+    async def find(self, addresses: Iterable[str], timeout: float = SCAN_TIMEOUT) -> Dict[str, BleakDevice]:
+        started = time.monotonic()
+        wanted = {address.upper() for address in addresses}
+        found: Dict[str, BleakDevice] = {}
+        for address in wanted:
+            device = self.seen(address)
+            if device is not None:
+                found[address] = device
+        if len(found) == len(wanted):
+            logger.info(f"Using recent sightings of {', '.join(sorted(found))}, skipping scan")
+            self.time_to_discover = time.monotonic() - started
+            return found
+
+        done = asyncio.Event()
+
+        def _scan_callback(device: BleakDevice, advertisement_data: Any) -> None:
+            address = device.address.upper()
+            if address not in self.sightings:
+                logger.info(f"\tDiscovered: {device}")
+            self.sightings[address] = Sighting(device, getattr(advertisement_data, "rssi", None), time.monotonic())
+            if address in wanted:
+                found[address] = device
+                if len(found) == len(wanted):
+                    done.set()
+
+        logger.info("Scanning for bluetooth devices...")
+        scanner = BleakScanner(detection_callback=_scan_callback)
+        await scanner.start()
+        try:
+            await asyncio.wait_for(done.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Scan timed out, missing {', '.join(sorted(wanted - found.keys()))}")
+        finally:
+            await scanner.stop()
+
+        self.time_to_discover = time.monotonic() - started
+        logger.info(f"Found {len(found)} of {len(wanted)} devices in {self.time_to_discover:.3f}s")
+        return found
@@ -0,0 +1,112 @@
+import asyncio
+import copy
+from typing import Dict, List, Optional, Tuple
+
+import frames
+from logger import logger
+from session import Session
+from supervisor import DesiredState, in_steps
+
+FIELDS = ("power", "color", "brightness", "timer")
+SCENE_TIMEOUT = 5.0
+
+
+class SceneError(Exception):
+    def __init__(self, failed: Dict[str, BaseException], rolled_back: bool):
+        causes = ", ".join(f"{field}: {cause!r}" for field, cause in failed.items())
+        super().__init__(f"Scene failed ({causes}){', rolled back' if rolled_back else ''}")
+        self.failed = failed
+        self.rolled_back = rolled_back
+
+
+class Scene(DesiredState):
+    """A complete look: any of power, color, brightness and timer. Settings left as None are not touched."""
+
+    def __init__(self, power: Optional[bool] = None, color: Optional[Tuple[int, int, int]] = None,
+                 brightness: Optional[int] = None, timer: Optional[int] = None):
+        super().__init__()
+        self.power = power
+        self.color = color
+        self.brightness = brightness
+        self.timer = timer
+
+    def changes(self, known: DesiredState) -> List[str]:
+        # Settings not written to the light since it connected
+        return [field for field in FIELDS
+                if getattr(self, field) is not None and getattr(self, field) != getattr(known, field)]
+
+    def commands(self, known: DesiredState) -> List[List[Tuple[str, bytes]]]:
+        """The minimal commands to get from `known` to this scene, as steps to send one after another.
+
+        See `supervisor.in_steps` for where power goes.
+        """
+        changes = self.changes(known)
+        encoders = {
+            "power": lambda: frames.encode_power(self.power),
+            "color": lambda: frames.encode_color(*self.color),
+            "brightness": lambda: frames.encode_brightness(self.brightness),
+            "timer": lambda: frames.encode_timer(self.timer),
+        }
+        # Encoders reuse their buffers, so every frame is copied as it is made
+        return in_steps([(field, bytes(encoders[field]())) for field in changes], lambda command: command[1])
+
+    def __repr__(self):
+        return 'Scene(power={!r}, color={!r}, brightness={!r}, timer={!r})'.format(
+            self.power, self.color, self.brightness, self.timer)
+
+
+async def apply(session: Session, scene: Scene, timeout: float = SCENE_TIMEOUT) -> List[str]:
+    """Sends a scene to one light as a single unit and returns the settings it changed.
+
+    The commands of each step are queued at once and pipelined within the
+    session's send window, and the light confirms each one; a step starts
+    once the one before it is confirmed. If anything fails, nothing after it
+    is sent, the settings that did change are put back to what they were
+    before and SceneError is raised.
+    """
+    before = copy.copy(session.known)
+    steps = scene.commands(before)
+    if not steps:
+        return []
+
+    changed, failed = await _send_steps(session, steps, timeout)
+    if not failed:
+        return changed
+
+    # Put back what did change, as far as it was known before
+    restore = Scene(**{field: getattr(before, field) for field in changed})
+    rollback = restore.commands(session.known)
+    logger.warning(f"Scene {scene} failed on {session.address} ({', '.join(failed)}), "
+                   f"rolling back {', '.join(field for step in rollback for field, _ in step) or 'nothing'}")
+    _, rollback_failed = await _send_steps(session, rollback, timeout)
+    raise SceneError(failed, not rollback_failed)
+
+
+async def _send_steps(session: Session, steps: List[List[Tuple[str, bytes]]],
+                      timeout: float) -> Tuple[List[str], Dict[str, BaseException]]:
+    # Returns the settings that were changed and those that failed; steps after a failure are not sent
+    changed: List[str] = []
+    failed: Dict[str, BaseException] = {}
+    for step in steps:
+        results = await asyncio.gather(*(_set(session, frame, timeout) for _, frame in step), return_exceptions=True)
+        for (field, _), result in zip(step, results):
+            if isinstance(result, BaseException):
+                failed[field] = result
+            else:
+                changed.append(field)
+        if failed:
+            break
+    return changed, failed
+
+
+async def _set(session: Session, frame: bytes, timeout: float) -> None:
+    if session.supervisor is not None:
+        session.supervisor.record(frame)
+    response = await session.request(frame, timeout)
+    if response.status != 0:
+        raise RuntimeError(f"status {response.status}")
+
+
+def submit(session: Session, scene: Scene, timeout: float = SCENE_TIMEOUT) -> "asyncio.Task[List[str]]":
+    # Queues the whole scene now; the task is its one completion future
+    return asyncio.create_task(apply(session, scene, timeout))
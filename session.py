@@ -0,0 +1,186 @@
+import asyncio
+import logging
+from functools import partial
+from typing import Callable, List, Optional, Tuple, Union
+
+from bleak import BleakClient
+from bleak.backends.device import BLEDevice as BleakDevice
+
+from channel import CommandChannel
+from classes import BytesLike, Response
+from gatt import CharacteristicIndex
+from handshake import Handshake
+from logger import Hex, logger, trace_logger
+from metrics import metrics
+from notification_handler import notification_handler
+from packetizer import Packetizer, acquire_mtu
+from pipeline import CommandQueue, DEFAULT_WINDOW
+from profile_cache import DeviceProfile, ProfileCache
+from supervisor import DesiredState, Supervisor, in_steps, probe
+
+CONNECT_TIMEOUT = 15.0
+
+ClientFactory = Callable[..., BleakClient]
+
+tx = trace_logger("tx")
+
+
+async def open_connection(device: Union[BleakDevice, str], handler: Callable[[int, bytearray], None],
+                          profiles: ProfileCache, client_factory: ClientFactory = BleakClient,
+                          timeout: float = CONNECT_TIMEOUT, **client_kwargs) -> Tuple[BleakClient, CharacteristicIndex]:
+    logger.info(f"Establishing BLE connection to {device}...")
+    client = client_factory(device, **client_kwargs)
+    return client, await prepare_connection(client, handler, profiles, timeout)
+
+
+async def prepare_connection(client: BleakClient, handler: Callable[[int, bytearray], None],
+                             profiles: ProfileCache, timeout: float = CONNECT_TIMEOUT) -> CharacteristicIndex:
+    # Connects (or reconnects) an existing client and runs the handshake on it
+    await client.connect(timeout=timeout)
+    logger.info("BLE Connected!")
+    try:
+        # Before the handshake, which may already need to fragment
+        await acquire_mtu(client)
+        # A profile that still matches the discovered services means pairing and reads were done before
+        profile = profiles.validate(client.address, client.services)
+        if profile is not None:
+            logger.info(f"Using cached profile {profile}")
+
+        index = CharacteristicIndex(client.services)
+        logger.info(f"Resolved characteristics: {index}")
+
+        handshake = Handshake(client, index, handler, profile)
+        await handshake.run()
+        if profile is None:
+            profiles.save(DeviceProfile.from_index(client.address, index, pairing=handshake.pairing))
+    except BaseException:
+        await client.disconnect()
+        raise
+    return index
+
+
+class Session:
+    """One connected light: its client, characteristic index, send queue and response channel."""
+
+    def __init__(self, address: str, profiles: Optional[ProfileCache] = None,
+                 client_factory: ClientFactory = BleakClient, window: int = DEFAULT_WINDOW, pack_writes: bool = False):
+        self.address = address
+        self.profiles = profiles or ProfileCache()
+        self.client_factory = client_factory
+        self.client: Optional[BleakClient] = None
+        self.index: Optional[CharacteristicIndex] = None
+        self.packetizer = Packetizer()
+        # Several frames per write on replay; only for lights known to accept that
+        self.pack_writes = pack_writes
+        self._fragmenting = asyncio.Lock()
+        self.queue = CommandQueue(self._write, window)
+        self.channel = CommandChannel(self.queue.send, self._is_response)
+        self.supervisor: Optional[Supervisor] = None
+        # What has been written to the light since it connected, as opposed to what was asked for
+        self.known = DesiredState()
+
+    @property
+    def connected(self) -> bool:
+        return self.client is not None and self.client.is_connected
+
+    @property
+    def handler(self) -> Callable[[int, bytearray], None]:
+        return partial(notification_handler, self.channel)
+
+    async def connect(self, device: Union[BleakDevice, str, None] = None, **client_kwargs) -> None:
+        self.attach(*await open_connection(
+            device or self.address, self.handler, self.profiles, self.client_factory,
+            disconnected_callback=self._disconnected, **client_kwargs))
+
+    async def reconnect(self) -> None:
+        if self.client is None:
+            return await self.connect()
+        # Reuse the client object so anything holding a reference to it keeps working
+        self.index = None
+        # The light may have been reset or changed by someone else while away
+        self.known = DesiredState()
+        self.index = await prepare_connection(self.client, self.handler, self.profiles)
+        self.packetizer = Packetizer.for_client(self.client)
+
+    def supervise(self, online: bool = True, **kwargs) -> Supervisor:
+        self.supervisor = Supervisor(self.address, self.reconnect, lambda: probe(self.client, self.index),
+                                     self.replay, **kwargs)
+        self.supervisor.start(online)
+        return self.supervisor
+
+    def attach(self, client: BleakClient, index: CharacteristicIndex) -> None:
+        self.client = client
+        self.index = index
+        self.packetizer = Packetizer.for_client(client)
+        self.known = DesiredState()
+
+    async def send(self, data: BytesLike, response: Optional[bool] = None) -> None:
+        if self.supervisor is not None and not self.supervisor.record(data):
+            # Offline: the supervisor replays the latest of each setting once reconnected
+            metrics.inc("commands_deferred", self.address)
+            return
+        try:
+            await self.queue.send(data, response)
+        except Exception:
+            metrics.inc("commands_failed", self.address)
+            raise
+        self.known.record(data)
+
+    async def replay(self, batch: List[bytes]) -> None:
+        # Each step is queued at once so it goes out back to back within the window
+        for step in in_steps(batch):
+            writes = self.packetizer.pack(step) if self.pack_writes else step
+            await asyncio.gather(*(self.queue.put(frame) for frame in writes))
+            for frame in step:
+                self.known.record(frame)
+
+    async def request(self, data: BytesLike, timeout: Optional[float] = None) -> Response:
+        try:
+            with metrics.timer("command_round_trip", self.address):
+                response = await self.channel.send(data, timeout=timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("command_timeouts", self.address)
+            raise
+        if response.status == 0:
+            self.known.record(data)
+        return response
+
+    async def disconnect(self) -> None:
+        if self.supervisor is not None:
+            await self.supervisor.stop()
+        self.channel.close()
+        await self.queue.close()
+        if self.client is not None:
+            await self.client.disconnect()
+
+    async def _write(self, data: BytesLike, response: bool) -> None:
+        if self.client is None or self.index is None:
+            raise ConnectionError(f"{self.address} is not connected")
+        if tx.isEnabledFor(logging.DEBUG):
+            tx.debug("Writing to %s (response=%s): %s", self.address, response, Hex(data))
+        if len(data) > self.packetizer.payload_size:
+            # The light reassembles one message at a time: nothing else may be written between its packets
+            async with self._fragmenting:
+                with metrics.timer("ble_write", self.address):
+                    for packet in self.packetizer.packets(data):
+                        await self.client.write_gatt_char(self.index.control, packet, response=response)
+        elif self._fragmenting.locked():
+            # A longer message is going out packet by packet; wait for it instead of landing inside it
+            async with self._fragmenting:
+                with metrics.timer("ble_write", self.address):
+                    await self.client.write_gatt_char(self.index.control, data, response=response)
+        else:
+            with metrics.timer("ble_write", self.address):
+                await self.client.write_gatt_char(self.index.control, data, response=response)
+
+    def _disconnected(self, _: BleakClient) -> None:
+        self.known = DesiredState()
+        if self.supervisor is not None:
+            self.supervisor.disconnected()
+
+    def _is_response(self, handle: int) -> bool:
+        # Until the handshake finishes there is no index yet, and nothing is waiting on replies either
+        return self.index is None or self.index.is_response(handle)
+
+    def __repr__(self):
+        return 'Session(address={!r}, connected={!r})'.format(self.address, self.connected)
@@ -0,0 +1,423 @@
+import asyncio
+import math
+import random
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from bleak.exc import BleakError
+
+import frames
+from classes import BytesLike, Response
+from codes import CONTROL_UUID, RESPONSE_UUID
+from logger import logger
+from packetizer import fragment
+from scanner import Scanner, Sighting
+
+DEVICE_NAME_UUID = "00002a00-0000-1000-8000-00805f9b34fb"
+FIRMWARE_UUID = "00002a26-0000-1000-8000-00805f9b34fb"
+FIRMWARE = b"1.0.0-sim"
+
+# Parameters in the reply to a state query
+PARAM_POWER = 0x01
+PARAM_COLOR = 0x02
+PARAM_BRIGHTNESS = 0x03
+PARAM_TIMER = 0x04
+PARAM_FIRMWARE = 0x05
+PARAM_PADDING = 0x7F
+
+STATUS_OK = 0x00
+STATUS_ERROR = 0x01
+
+
+class Link:
+    """Radio conditions between the simulated light and the client.
+
+    Packets only move at connection events `connection_interval` apart, at most
+    `packets_per_event` each way. `mtu` is the ATT MTU, so packets carry
+    `mtu - 3` bytes. The device takes `latency` (plus up to `jitter`) to answer
+    a command. `loss` is the chance a notification packet never arrives; lost
+    writes are retried by the link layer and only cost another interval.
+    """
+
+    def __init__(self, connection_interval: float = 0.0075, mtu: int = 23, latency: float = 0.002,
+                 jitter: float = 0.0, loss: float = 0.0, packets_per_event: int = 4,
+                 connect_time: float = 0.05, seed: Optional[int] = None):
+        self.connection_interval = connection_interval
+        self.mtu = mtu
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.packets_per_event = packets_per_event
+        self.connect_time = connect_time
+        self.random = random.Random(seed)
+
+    @property
+    def payload_size(self) -> int:
+        return self.mtu - 3
+
+    def __repr__(self):
+        return 'Link(connection_interval={!r}, mtu={!r}, latency={!r}, jitter={!r}, loss={!r})'.format(
+            self.connection_interval, self.mtu, self.latency, self.jitter, self.loss)
+
+
+class SimulatedCharacteristic:
+    def __init__(self, handle: int, uuid: str, properties: List[str], description: str = ""):
+        self.handle = handle
+        self.uuid = uuid
+        self.properties = properties
+        self.description = description
+        self.descriptors: List = []
+
+    def __repr__(self):
+        return 'SimulatedCharacteristic(handle={!r}, uuid={!r}, properties={!r})'.format(
+            self.handle, self.uuid, self.properties)
+
+
+class SimulatedServices:
+    """The slice of BleakGATTServiceCollection the package reads."""
+
+    def __init__(self, characteristics: Iterable[SimulatedCharacteristic]):
+        self.characteristics: Dict[int, SimulatedCharacteristic] = {char.handle: char for char in characteristics}
+
+    def get_characteristic(self, specifier) -> Optional[SimulatedCharacteristic]:
+        if isinstance(specifier, int):
+            return self.characteristics.get(specifier)
+        if isinstance(specifier, SimulatedCharacteristic):
+            return specifier
+        for char in self.characteristics.values():
+            if char.uuid.lower() == str(specifier).lower():
+                return char
+        return None
+
+    def __iter__(self):
+        return iter(self.characteristics.values())
+
+
+class SimulatedDevice:
+    """An MZDS01 light: its GATT table and the state the command frames change.
+
+    It survives reconnects, so a new client to the same device sees the
+    state the last one left behind. `query_padding` adds that many filler
+    bytes to query replies, to exercise the long-message headers.
+    """
+
+    def __init__(self, address: str, name: str = "MZDS01 (simulated)", query_padding: int = 0):
+        self.address = address
+        self.name = name
+        self.query_padding = query_padding
+        self.services = SimulatedServices([
+            SimulatedCharacteristic(0x0003, DEVICE_NAME_UUID, ["read"], "Device Name"),
+            SimulatedCharacteristic(0x0005, FIRMWARE_UUID, ["read"], "Firmware Revision"),
+            SimulatedCharacteristic(0x000E, CONTROL_UUID, ["write", "write-without-response"], "Control"),
+            SimulatedCharacteristic(0x0010, RESPONSE_UUID, ["notify"], "Response"),
+        ])
+        self.control = self.services.get_characteristic(CONTROL_UUID)
+        self.response = self.services.get_characteristic(RESPONSE_UUID)
+
+        self.power = False
+        self.color = (0, 0, 0)
+        self.brightness = frames.MAX_BRIGHTNESS
+        self.timer = 0
+        self.clock: Optional[bytes] = None
+        self.commands = 0
+        self.errors = 0
+        self._inbound = Response()
+
+    def read(self, handle: int) -> bytearray:
+        if handle == 0x0003:
+            return bytearray(self.name.encode())
+        if handle == 0x0005:
+            return bytearray(FIRMWARE)
+        raise BleakError(f"Characteristic {handle:#06x} is not readable")
+
+    def receive(self, data: BytesLike) -> List[bytes]:
+        """Takes one write to the control characteristic and returns a reply per complete frame in it.
+
+        A write is either whole frames back to back, or a packet of a longer
+        frame sent in the response header and continuation format.
+        """
+        # Frames start with 0xFE, packets of a longer message with a header byte or the 0x80 continuation marker
+        if data[0] != 0xFE:
+            self._inbound.accumulate(data)
+            if not self._inbound.is_received:
+                return []
+            data = bytes(self._inbound.bytes)
+        replies = []
+        pos = 0
+        while pos < len(data):
+            end = pos + data[pos + frames.LENGTH_OFFSET] + 4 if pos + frames.LENGTH_OFFSET < len(data) else len(data)
+            replies.append(self.handle_frame(bytes(data[pos:end])))
+            pos = end
+        return replies
+
+    def handle_frame(self, frame: bytes) -> bytes:
+        """Applies one command frame and returns the reply message (id, status, parameters)."""
+        self.commands += 1
+        if len(frame) < 6 or frame[:3] != b"\xfe\x01\x00" or frame[frames.LENGTH_OFFSET] != len(frame) - 4:
+            self.errors += 1
+            logger.warning(f"Simulated {self.address} got a malformed frame {frame.hex(':')}")
+            return bytes([frame[frames.OPCODE_OFFSET] if len(frame) > frames.OPCODE_OFFSET else 0, STATUS_ERROR])
+
+        op, sub, payload = frame[4], frame[5], frame[6:]
+        status = STATUS_OK
+        params = b""
+        if op == frames.OP_POWER and payload:
+            self.power = bool(payload[0])
+        elif op == frames.OP_COLOR and len(payload) >= 3:
+            self.color = (payload[0], payload[1], payload[2])
+        elif op == frames.OP_BRIGHTNESS and payload and payload[0] <= frames.MAX_BRIGHTNESS:
+            self.brightness = payload[0]
+        elif op == frames.OP_TIMER and sub == 0x03 and payload:
+            self.timer = payload[-1]
+        elif op == frames.OP_TIMER and sub == 0x04:
+            params = self._state()
+        elif op == frames.OP_SYSTEM and sub == 0x01:
+            self.clock = bytes(payload)
+        elif op == frames.OP_SYSTEM and sub == 0x11:
+            params = bytes([PARAM_FIRMWARE, len(FIRMWARE)]) + FIRMWARE
+        else:
+            self.errors += 1
+            status = STATUS_ERROR
+        return bytes([op, status]) + params
+
+    def _state(self) -> bytes:
+        params = bytearray()
+        params += bytes([PARAM_POWER, 1, self.power])
+        params += bytes([PARAM_COLOR, 3, *self.color])
+        params += bytes([PARAM_BRIGHTNESS, 1, self.brightness])
+        params += bytes([PARAM_TIMER, 1, self.timer])
+        padding = self.query_padding
+        while padding > 0:
+            chunk = min(padding, 0xFF)
+            params += bytes([PARAM_PADDING, chunk]) + bytes(chunk)
+            padding -= chunk
+        return bytes(params)
+
+    def __repr__(self):
+        return 'SimulatedDevice(address={!r}, power={!r}, color={!r}, brightness={!r})'.format(
+            self.address, self.power, self.color, self.brightness)
+
+
+class SimulatedDeviceHandle:
+    # What a scan hands out, enough of BLEDevice for logging and connecting
+    def __init__(self, device: SimulatedDevice):
+        self.address = device.address
+        self.name = device.name
+
+    def __repr__(self):
+        return '{}: {}'.format(self.address, self.name)
+
+
+class SimulatedClient:
+    """Drop-in for the parts of BleakClient the package uses, talking to a SimulatedDevice."""
+
+    def __init__(self, device: SimulatedDevice, link: Optional[Link] = None,
+                 disconnected_callback: Optional[Callable[["SimulatedClient"], None]] = None, **_):
+        self.device = device
+        self.link = link or Link()
+        self._disconnected_callback = disconnected_callback
+        self._notify: Dict[int, Callable] = {}
+        self._connected = False
+        self._epoch = 0.0
+        self._next_event = 0.0
+        self._in_event = 0
+        self.notifications_lost = 0
+
+    @property
+    def address(self) -> str:
+        return self.device.address
+
+    @property
+    def services(self) -> SimulatedServices:
+        return self.device.services
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    @property
+    def mtu_size(self) -> int:
+        return self.link.mtu
+
+    def set_disconnected_callback(self, callback: Optional[Callable[["SimulatedClient"], None]], **_) -> None:
+        self._disconnected_callback = callback
+
+    async def connect(self, timeout: float = 10.0, **_) -> bool:
+        if self.link.connect_time > timeout:
+            raise asyncio.TimeoutError(f"Simulated connect to {self.address} timed out")
+        await asyncio.sleep(self.link.connect_time)
+        self._connected = True
+        self._epoch = self._next_event = time.monotonic()
+        self._in_event = 0
+        return True
+
+    async def disconnect(self) -> bool:
+        if self._connected:
+            self._lose_link()
+        return True
+
+    def drop(self) -> None:
+        """Simulates the light going out of range."""
+        if self._connected:
+            logger.info(f"Simulated {self.address} dropped the connection")
+            self._lose_link()
+
+    def _lose_link(self) -> None:
+        self._connected = False
+        self._notify.clear()
+        if self._disconnected_callback is not None:
+            self._disconnected_callback(self)
+
+    async def pair(self, *_, **__) -> bool:
+        self._check()
+        return True
+
+    async def start_notify(self, char, callback: Callable, **_) -> None:
+        self._check()
+        self._notify[self._resolve(char).handle] = callback
+
+    async def stop_notify(self, char) -> None:
+        self._notify.pop(self._resolve(char).handle, None)
+
+    async def read_gatt_char(self, char, **_) -> bytearray:
+        self._check()
+        handle = self._resolve(char).handle
+        # Request in one connection event, value back in the next
+        await self._wait_for_slot()
+        await self._wait_for_slot()
+        return self.device.read(handle)
+
+    async def write_gatt_char(self, char, data: BytesLike, response: bool = False) -> None:
+        self._check()
+        target = self._resolve(char)
+        if target.handle != self.device.control.handle:
+            raise BleakError(f"Characteristic {target.handle:#06x} is not writable")
+        if len(data) > self.link.payload_size:
+            raise BleakError(f"{len(data)} bytes exceed the {self.link.payload_size} byte ATT payload")
+        frame = bytes(data)
+        await self._wait_for_slot()
+        while self.link.random.random() < self.link.loss:
+            # Retransmitted by the link layer in the next event
+            await self._wait_for_slot()
+        if response:
+            # The write response comes back a connection event later
+            await self._wait_for_slot()
+        delay = self.link.latency + self.link.random.uniform(0, self.link.jitter)
+        for reply in self.device.receive(frame):
+            asyncio.get_running_loop().call_later(delay, self._send_reply, reply)
+
+    def _send_reply(self, message: bytes) -> None:
+        if not self._connected:
+            return
+        loop = asyncio.get_running_loop()
+        callback = self._notify.get(self.device.response.handle)
+        for packet in fragment(message, self.link.payload_size):
+            at = self._reserve_slot()
+            if callback is None:
+                continue
+            if self.link.random.random() < self.link.loss:
+                self.notifications_lost += 1
+                continue
+            loop.call_at(loop.time() + max(0.0, at - time.monotonic()), self._deliver, callback, packet)
+
+    def _deliver(self, callback: Callable, packet: bytes) -> None:
+        if not self._connected:
+            return
+        result = callback(self.device.response.handle, bytearray(packet))
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
+
+    def _reserve_slot(self) -> float:
+        # Time of the next connection event with room for one more packet
+        interval = self.link.connection_interval
+        now = time.monotonic()
+        if self._next_event < now:
+            self._next_event = self._epoch + math.ceil((now - self._epoch) / interval) * interval
+            self._in_event = 0
+        if self._in_event >= self.link.packets_per_event:
+            self._next_event += interval
+            self._in_event = 0
+        self._in_event += 1
+        return self._next_event
+
+    async def _wait_for_slot(self) -> None:
+        delay = self._reserve_slot() - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._check()
+
+    def _resolve(self, char) -> SimulatedCharacteristic:
+        resolved = self.services.get_characteristic(getattr(char, "handle", char))
+        if resolved is None:
+            raise BleakError(f"Characteristic {char} was not found")
+        return resolved
+
+    def _check(self) -> None:
+        if not self._connected:
+            raise BleakError("Not connected")
+
+    def __repr__(self):
+        return 'SimulatedClient(address={!r}, connected={!r}, link={!r})'.format(
+            self.address, self._connected, self.link)
+
+
+class Simulator:
+    """A set of simulated lights with one shared link model.
+
+    `client_factory` takes the place of BleakClient wherever a client
+    factory is accepted (Session, Fleet, open_connection, connect_ble), and
+    `scanner` stands in for Scanner.
+    """
+
+    def __init__(self, addresses: Iterable[str] = (), link: Optional[Link] = None, **device_kwargs):
+        self.link = link or Link()
+        self.device_kwargs = device_kwargs
+        self.devices: Dict[str, SimulatedDevice] = {}
+        self.clients: List[SimulatedClient] = []
+        for address in addresses:
+            self.add(address)
+
+    def add(self, address: str) -> SimulatedDevice:
+        device = self.devices.get(address.upper())
+        if device is None:
+            device = self.devices[address.upper()] = SimulatedDevice(address, **self.device_kwargs)
+        return device
+
+    def client_factory(self, device: Union[str, SimulatedDeviceHandle], **kwargs) -> SimulatedClient:
+        address = device if isinstance(device, str) else device.address
+        client = SimulatedClient(self.add(address), self.link, **kwargs)
+        self.clients.append(client)
+        return client
+
+    def scanner(self, advertising_interval: float = 0.1, **kwargs) -> "SimulatedScanner":
+        return SimulatedScanner(self, advertising_interval, **kwargs)
+
+    def __repr__(self):
+        return 'Simulator(devices={!r}, link={!r})'.format(sorted(self.devices), self.link)
+
+
+class SimulatedScanner(Scanner):
+    """Finds simulated lights after one advertising interval at most."""
+
+    def __init__(self, simulator: Simulator, advertising_interval: float = 0.1, **kwargs):
+        super().__init__(**kwargs)
+        self.simulator = simulator
+        self.advertising_interval = advertising_interval
+
+    async def find(self, addresses: Iterable[str], timeout: float = 5.0) -> Dict[str, SimulatedDeviceHandle]:
+        started = time.monotonic()
+        found = {}
+        advertised = False
+        for address in {address.upper() for address in addresses}:
+            device = self.seen(address)
+            if device is None and address in self.simulator.devices:
+                device = SimulatedDeviceHandle(self.simulator.devices[address])
+                self.sightings[address] = Sighting(device, -50, time.monotonic())
+                advertised = True
+            if device is not None:
+                found[address] = device
+        if advertised:
+            # Wait for the next advertisement, like a real scan would
+            await asyncio.sleep(min(timeout, self.simulator.link.random.uniform(0, self.advertising_interval)))
+        self.time_to_discover = time.monotonic() - started
+        return found
@@ -0,0 +1,189 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+from bleak import BleakClient
+
+import frames
+from classes import BytesLike
+from codes import codes
+from gatt import CharacteristicIndex
+from logger import logger
+from scanner import backoff
+
+KEEPALIVE_INTERVAL = 10.0
+KEEPALIVE_TIMEOUT = 3.0
+
+SUB_POWER = 0x01
+SUB_COLOR = 0x01
+SUB_BRIGHTNESS = 0x02
+SUB_TIMER = 0x03
+
+T = TypeVar("T")
+
+
+def power_of(frame: BytesLike) -> Optional[bool]:
+    # Whether a frame switches the light on or off, None for anything else
+    if frame[frames.OPCODE_OFFSET] == frames.OP_POWER and frame[frames.OPCODE_OFFSET + 1] == SUB_POWER:
+        return bool(frame[frames.OPCODE_OFFSET + 2])
+    return None
+
+
+def in_steps(commands: List[T], frame: Callable[[T], BytesLike] = lambda command: command) -> List[List[T]]:
+    """Splits commands into steps to send one after another, each awaited before the next.
+
+    Switching on goes alone before the rest, so the light is on before it is
+    told what to show; switching off goes alone after them, so they still
+    land. Within a step the send window may reorder writes.
+    """
+    on: List[T] = []
+    rest: List[T] = []
+    off: List[T] = []
+    for command in commands:
+        power = power_of(frame(command))
+        (rest if power is None else on if power else off).append(command)
+    return [step for step in (on, rest, off) if step]
+
+
+class DesiredState:
+    """The last power, color, brightness and timer the user asked for, whether or not it reached the light."""
+
+    def __init__(self):
+        self.power: Optional[bool] = None
+        self.color: Optional[Tuple[int, int, int]] = None
+        self.brightness: Optional[int] = None
+        self.timer: Optional[int] = None
+
+    def record(self, frame: BytesLike) -> None:
+        op, sub = frame[frames.OPCODE_OFFSET], frame[frames.OPCODE_OFFSET + 1]
+        payload = frames.OPCODE_OFFSET + 2
+        if op == frames.OP_POWER and sub == SUB_POWER:
+            self.power = bool(frame[payload])
+        elif op == frames.OP_COLOR and sub == SUB_COLOR:
+            self.color = (frame[payload], frame[payload + 1], frame[payload + 2])
+        elif op == frames.OP_BRIGHTNESS and sub == SUB_BRIGHTNESS:
+            self.brightness = frame[payload]
+        elif op == frames.OP_TIMER and sub == SUB_TIMER:
+            self.timer = frame[-1]
+
+    def frames(self) -> List[bytes]:
+        # Power first; replaying them goes through in_steps, which holds the rest back until it is on
+        result = []
+        if self.power is not None:
+            result.append(bytes(frames.encode_power(self.power)))
+        if self.color is not None:
+            result.append(bytes(frames.encode_color(*self.color)))
+        if self.brightness is not None:
+            result.append(bytes(frames.encode_brightness(self.brightness)))
+        if self.timer is not None:
+            result.append(bytes(frames.encode_timer(self.timer)))
+        return result
+
+    def __repr__(self):
+        return 'DesiredState(power={!r}, color={!r}, brightness={!r}, timer={!r})'.format(
+            self.power, self.color, self.brightness, self.timer)
+
+
+async def probe(client: BleakClient, index: CharacteristicIndex) -> None:
+    # Cheapest round trip that proves the link is alive: a read if the device has one, else an acked query
+    if index.readable:
+        await client.read_gatt_char(index.readable[0])
+    else:
+        await client.write_gatt_char(index.control, codes["handshake"]["query"], response=True)
+
+
+class Supervisor:
+    """Keeps one light connected: notices drops, reconnects in the background and replays the desired state.
+
+    Drops are reported through `disconnected` (wire it to bleak's disconnected
+    callback) or found by a periodic keepalive. Commands recorded while the
+    light is away are not sent; the latest of each kind is replayed in one
+    burst once the connection is back.
+    """
+
+    def __init__(self, name: str, reconnect: Callable[[], Awaitable[None]], keepalive: Callable[[], Awaitable[None]],
+                 replay: Callable[[List[bytes]], Awaitable[None]],
+                 interval: float = KEEPALIVE_INTERVAL, timeout: float = KEEPALIVE_TIMEOUT):
+        self.name = name
+        self._reconnect = reconnect
+        self._keepalive = keepalive
+        self._replay = replay
+        self.interval = interval
+        self.timeout = timeout
+
+        self.desired = DesiredState()
+        self.online = asyncio.Event()
+        self._lost = asyncio.Event()
+        self._lost_at: Optional[float] = None
+        self._tasks: List[asyncio.Task] = []
+        self.reconnects = 0
+        self.last_outage: Optional[float] = None
+
+    def start(self, online: bool = True) -> None:
+        # Started on a light that never connected, it keeps trying in the background
+        if online:
+            self.online.set()
+        else:
+            self._lost_at = time.monotonic()
+            self._lost.set()
+        self._tasks = [asyncio.create_task(self._supervise()), asyncio.create_task(self._keep_alive())]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def disconnected(self, *_) -> None:
+        if not self._tasks:
+            # Stopped, so this is our own disconnect on the way out
+            return
+        if self.online.is_set():
+            logger.warning(f"{self.name} disconnected, reconnecting in the background")
+            self._lost_at = time.monotonic()
+        self.online.clear()
+        self._lost.set()
+
+    def record(self, frame: BytesLike) -> bool:
+        # True if the frame should be sent now, False if it will be replayed after the reconnect
+        self.desired.record(frame)
+        return self.online.is_set()
+
+    async def _supervise(self) -> None:
+        while True:
+            await self._lost.wait()
+            attempt = 0
+            while True:
+                self._lost.clear()
+                try:
+                    await self._reconnect()
+                    replayed = self.desired.frames()
+                    await self._replay(replayed)
+                    # Commands recorded during the replay were deferred too; go again until nothing new came in
+                    latest = self.desired.frames()
+                    while not self._lost.is_set() and latest != replayed:
+                        await self._replay([frame for frame in latest if frame not in replayed])
+                        replayed, latest = latest, self.desired.frames()
+                    break
+                except Exception as e:
+                    logger.warning(f"Reconnecting {self.name} failed (attempt {attempt + 1}): {e}")
+                    await asyncio.sleep(backoff(attempt))
+                    attempt += 1
+            if self._lost.is_set():
+                # Dropped again while replaying, go round once more
+                continue
+            self.reconnects += 1
+            self.last_outage = time.monotonic() - self._lost_at if self._lost_at is not None else None
+            self.online.set()
+            logger.info(f"{self.name} back online after {self.last_outage or 0:.3f}s, replayed {self.desired}")
+
+    async def _keep_alive(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.online.is_set():
+                continue
+            try:
+                await asyncio.wait_for(self._keepalive(), self.timeout)
+            except Exception as e:
+                logger.warning(f"Keepalive to {self.name} failed: {e!r}")
+                self.disconnected()
@@ -1,23 +1,76 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, List, Optional
+
 from textual.app import App, ComposeResult
 from textual.containers import Container, Content, Horizontal
 from textual.widgets import Header, Footer, Static, Input, TextLog, Button, Switch, Label, Placeholder
 
+import frames
+from codes import codes, BLUETOOTH_ADDRESS
+from coalesce import Coalescer
+from logger import logger, sh, use_handlers
+from main import connect_ble
+from session import Session
+
+LOG_CAPACITY = 1000  # lines kept while the panel catches up, older ones are dropped
+LOG_RENDER_RATE = 10  # log panel refreshes per second
+LOG_BATCH = 200  # most lines rendered in one refresh
+
+COLOR_BUTTONS = {
+    "warm-white": "WWHITE",
+    "blue": "DBLUE",
+    "red": "RED",
+    "purple": "INDIGO",
+    "violet": "VIOLET",
+    "green": "GREEN",
+    "light-blue": "LBLUE",
+}
+
+
+class LogBuffer(logging.Handler):
+    """Bounded ring of formatted log lines, drained by the UI at its own pace."""
+
+    def __init__(self, capacity: int = LOG_CAPACITY):
+        super().__init__()
+        self.lines: Deque[str] = deque(maxlen=capacity)
+        self.dropped = 0
+        self.setFormatter(logging.Formatter("%(asctime)s.%(msecs)03d %(levelname)s %(message)s", datefmt="%H:%M:%S"))
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if len(self.lines) == self.lines.maxlen:
+            self.dropped += 1
+        self.lines.append(self.format(record))
+
+    def drain(self, limit: int = LOG_BATCH) -> List[str]:
+        # emit runs on the logging thread under the handler's lock, so take it too or lines slip in unseen
+        with self.lock:
+            # Only the newest `limit` lines are worth drawing, the rest count as dropped
+            while len(self.lines) > limit:
+                self.lines.popleft()
+                self.dropped += 1
+            lines = list(self.lines)
+            self.lines.clear()
+        return lines
+
+
 class LeftColumn(Static):
     def compose(self) -> ComposeResult:
         yield Label("Power")
-        yield Switch()
+        yield Switch(value=True, id="power")
         yield Placeholder("placeholder")
 
 class CenterColumn(Static):
     def compose(self) -> ComposeResult:
         yield Label("Colors")
-        yield Button("Warm White")
-        yield Button("Blue")
-        yield Button("Red")
-        yield Button("Purple")
-        yield Button("Violet")
-        yield Button("Green")
-        yield Button("Light Blue")
+        yield Button("Warm White", id="warm-white")
+        yield Button("Blue", id="blue")
+        yield Button("Red", id="red")
+        yield Button("Purple", id="purple")
+        yield Button("Violet", id="violet")
+        yield Button("Green", id="green")
+        yield Button("Light Blue", id="light-blue")
 
 class RightColumn(Static):
     def compose(self) -> ComposeResult:
@@ -26,7 +79,17 @@ class RightColumn(Static):
 
 class LightApp(App):
     CSS_PATH = "gui.css"
+    BINDINGS = [("q", "quit", "Quit")]
     """A Textual app to manage a light."""
+
+    def __init__(self, address: str = BLUETOOTH_ADDRESS, **kwargs):
+        super().__init__(**kwargs)
+        self.session = Session(address)
+        # UI events never wait on the radio: each kind of command keeps only its latest value
+        self.commands = Coalescer(self.session.send)
+        self.log_buffer = LogBuffer()
+        self._connecting: Optional[asyncio.Task] = None
+
     def compose(self) -> ComposeResult:
         yield Header()
         yield Footer()
@@ -35,13 +98,63 @@ class LightApp(App):
         yield Container(RightColumn(), id="right-column")
 
         with Content(id="logs-container"):
-            yield TextLog(id="textlog")
+            yield TextLog(id="textlog", max_lines=LOG_CAPACITY)
 
     def on_mount(self) -> None:
         """Called when app starts."""
-        # Give the input focus, so we can start typing straight away
-        # self.query_one(Input).focus()
-        ...
+        # The console handler would draw over the screen, so logs go to the panel instead
+        use_handlers(self.log_buffer)
+        self.set_interval(1 / LOG_RENDER_RATE, self.render_log)
+        # Connect on the app's own event loop so the UI stays live while it scans
+        self._connecting = asyncio.create_task(self.connect())
+
+    async def connect(self) -> None:
+        try:
+            self.session.attach(*await connect_ble(self.session.handler, address=self.session.address))
+        except Exception as e:
+            logger.error(f"Could not connect: {e}")
+            return
+        self.session.supervise()
+        logger.info(f"Connected to {self.session.address}")
+
+    def render_log(self) -> None:
+        lines = self.log_buffer.drain()
+        dropped, self.log_buffer.dropped = self.log_buffer.dropped, 0
+        if not lines and not dropped:
+            return
+        textlog = self.query_one(TextLog)
+        if dropped:
+            textlog.write(f"... {dropped} lines skipped")
+        for line in lines:
+            textlog.write(line)
+
+    def on_button_pressed(self, event: Button.Pressed) -> None:
+        name = COLOR_BUTTONS.get(event.button.id)
+        if name is not None:
+            logger.info(f"Color {name}")
+            self.commands.submit(codes["colors"][name])
+
+    def on_switch_changed(self, event: Switch.Changed) -> None:
+        logger.info(f"Power {'on' if event.value else 'off'}")
+        self.commands.submit(frames.encode_power(event.value))
+
+    def on_input_submitted(self, event: Input.Submitted) -> None:
+        value = event.value.strip().lstrip("#")
+        try:
+            r, g, b = bytes.fromhex(value)
+        except ValueError:
+            logger.warning(f"'{event.value}' is not a hex color like #ff8800")
+            return
+        logger.info(f"Color #{value}")
+        self.commands.submit(frames.encode_color(r, g, b))
+
+    async def action_quit(self) -> None:
+        if self._connecting is not None:
+            self._connecting.cancel()
+        await self.commands.close()
+        await self.session.disconnect()
+        use_handlers(sh)
+        self.exit()
 
 
 if __name__ == "__main__":